@@ -1,33 +1,116 @@
 import os
+import csv
+import gzip
+import time
+import json
+import hashlib
+import sqlite3
+import threading
+import uuid
+import copy
+import math
+import re
+import random
+import bisect
+import itertools
+import operator
+import multiprocessing
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from array import array
 from getpass import getpass
 from dotenv import load_dotenv
 from werkzeug.utils import secure_filename
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context, g, has_request_context
 import logging
-from typing import List, Optional, Union, Dict, Any
+from typing import List, Optional, Union, Dict, Any, Iterator, Sequence
 
 import openpyxl
+import numpy as np
 
 import chromadb
 from chromadb.utils import embedding_functions
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
 
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import JsonOutputParser
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, ValidationError
+from openai import RateLimitError
+
+try:
+    import tiktoken
+except ImportError:  # Token counts fall back to a characters-per-token estimate.
+    tiktoken = None
+
+try:
+    import fcntl
+except ImportError:  # Windows: ingestions are serialized per process only; generation names still cannot collide.
+    fcntl = None
 
 load_dotenv()
-if "OPENAI_API_KEY" not in os.environ:
-    os.environ["OPENAI_API_KEY"] = getpass("Enter your OpenAI API Key: ")
 
 UPLOAD_FOLDER = "uploads"
 CHROMA_PERSIST_DIR = "chroma_prod_data_storage"
 CHROMA_COLLECTION_NAME = "product_catalog_from_orders"
 DEFAULT_DATA_FILE_PATH = 'static/file/data.xlsx'
 EXCEL_PROCESSING_BATCH_SIZE = 2000
+INGEST_AGGREGATION_CHUNK_ROWS = 50000  # Rows aggregated per vectorized pass; also the progress/log interval.
+ORDER_DATA_FILE_EXTENSIONS = (".xlsx", ".xlsm", ".csv", ".csv.gz")
+INGEST_STATE_FILE = os.path.join(CHROMA_PERSIST_DIR, "ingest_state.json")
+SHARED_STATE_PATH = os.path.join(CHROMA_PERSIST_DIR, "shared_state.sqlite3")
+INGEST_LOCK_PATH = os.path.join(CHROMA_PERSIST_DIR, "ingest.lock")
+STARTUP_INGEST_LOCK_PATH = os.path.join(CHROMA_PERSIST_DIR, "startup_ingest.lock")
+INGEST_JOB_SYNC_SECONDS = 1.0
+EMBEDDING_MODEL_NAME = "text-embedding-ada-002"
+EMBEDDING_CACHE_PATH = os.path.join(CHROMA_PERSIST_DIR, "embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "200000"))
+INGEST_MAX_WORKERS = int(os.getenv("INGEST_MAX_WORKERS", "1"))
+INGEST_MAX_TRACKED_JOBS = 100
+INGEST_PARSE_WORKERS = int(os.getenv("INGEST_PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))  # Processes for multi-file/sheet parsing.
+# Parse workers must not be forked from a process that runs request, ingestion and Chroma threads.
+INGEST_PARSE_START_METHOD = os.getenv("INGEST_PARSE_START_METHOD", "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+CATALOG_GENERATION_SEPARATOR = "__g"
 LLM_CONTEXT_PRODUCT_LIMIT = 30 
+PROMPT_TEMPLATE_VERSION = "2"  # Bump whenever the bundle prompt changes so cached responses are not reused.
+LLM_RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("LLM_RESPONSE_CACHE_MAX_ENTRIES", "512"))
+LLM_RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("LLM_RESPONSE_CACHE_TTL_SECONDS", "3600"))
+LLM_RESPONSE_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("LLM_RESPONSE_CACHE_SIMILARITY_THRESHOLD", "0.97"))
+COMPONENTS_INIT_RETRY_SECONDS = float(os.getenv("COMPONENTS_INIT_RETRY_SECONDS", "5"))  # Backoff after a failed init_components().
+COPURCHASE_INDEX_PATH = os.path.join(CHROMA_PERSIST_DIR, "copurchase_index.npz")
+COPURCHASE_MIN_CO_ORDERS = int(os.getenv("COPURCHASE_MIN_CO_ORDERS", "2"))
+COPURCHASE_MAX_BASKET_SIZE = 50  # Very large orders (B2B, bulk) add noise and quadratic pair counts.
+COPURCHASE_EXPANSION_SEEDS = 5
+COPURCHASE_PARTNERS_PER_SEED = 3
+COPURCHASE_CONTEXT_EXPANSION_LIMIT = 10
+LEXICAL_INDEX_PATH = os.path.join(CHROMA_PERSIST_DIR, "lexical_index.json")
+CATALOG_SNAPSHOT_PATH = os.path.join(CHROMA_PERSIST_DIR, "catalog_snapshot.npz")
+CATALOG_AGGREGATION_VERSION = "2"  # Bump when the per-SKU aggregation rules change so old snapshots are not reused.
+HYBRID_RESULT_LIMIT = int(os.getenv("HYBRID_RESULT_LIMIT", "20"))
+RRF_K = 60
+RETRIEVAL_MIN_FILTERED_RESULTS = 3  # Fewer filtered hits than this and the prompt is retrieved again without filters.
+PRODUCT_METADATA_VERSION = "2"  # Part of the content hash; bump when new metadata fields must reach existing products.
+LLM_CONTEXT_TOKEN_BUDGETS = {"gpt-3.5-turbo": 1500, "gpt-4": 2000, "gpt-4-turbo": 3000}
+LLM_CONTEXT_TOKEN_BUDGET_OVERRIDE = int(os.getenv("LLM_CONTEXT_TOKEN_BUDGET", "0"))
+BUNDLE_MAX_DISCOUNT_PERCENT = 90.0
+LLM_BATCH_MAX_PROMPTS = 100
+LLM_BATCH_MAX_CONCURRENCY = int(os.getenv("LLM_BATCH_MAX_CONCURRENCY", "4"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))  # 0 disables client-side TPM limiting.
+LLM_ESTIMATED_OUTPUT_TOKENS = 700
+LLM_RATE_LIMIT_MAX_RETRIES = 4
+LLM_RATE_LIMIT_BACKOFF_SECONDS = 1.0
+REQUEST_ID_HEADER = "X-Request-ID"
+SLOW_REQUEST_LOG_SECONDS = float(os.getenv("SLOW_REQUEST_LOG_SECONDS", "10"))  # 0 disables the slow-request log.
+SERVER_TIMING_ENABLED = os.getenv("SERVER_TIMING_ENABLED", "1") == "1"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+THROUGHPUT_BUCKETS = (1, 10, 100, 1000, 10000, 100000, 1000000)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 1500, 2000, 4000, 8000, 16000)
+# Off by default. When on, every worker asks for it but only the process holding the startup lock file runs it.
+INGEST_DEFAULT_DATA_ON_STARTUP = os.getenv("INGEST_DEFAULT_DATA_ON_STARTUP", "0") == "1"
 
 DEFAULT_ORDERS_SHEET = "orders"
+ORDERS_SHEET_SHARD_PREFIX = DEFAULT_ORDERS_SHEET + "_"  # Workbooks may split orders across sheets, e.g. orders_2023, orders_2024.
 ORDERS_ORDER_NUMBER_COLUMN = "OrderNumber"
 ORDERS_SKU_COLUMN = "SKU"
 ORDERS_ITEM_TITLE_COLUMN = "Item title"
@@ -51,6 +134,129 @@ logging.getLogger('httpx').setLevel(logging.WARNING)
 logging.getLogger('openai').setLevel(logging.WARNING) 
 logging.getLogger('openapi_python_client').setLevel(logging.WARNING)
 
+# --- Metrics and request tracing ---
+METRIC_DESCRIPTIONS = {
+    "http_request_duration_seconds": ("histogram", "HTTP request latency by route, method and status."),
+    "bundle_stage_duration_seconds": ("histogram", "Latency of each stage of a bundle request."),
+    "llm_prompt_tokens": ("histogram", "Prompt tokens per LLM call."),
+    "llm_completion_tokens": ("histogram", "Completion tokens per LLM call, counted on the parsed bundle JSON."),
+    "bundle_response_cache_lookups_total": ("counter", "Bundle response cache lookups by result."),
+    "bundle_validation_total": ("counter", "Bundle validation outcomes."),
+    "embedding_cache_lookups_total": ("counter", "Embedding cache lookups by result."),
+    "embedding_request_duration_seconds": ("histogram", "Latency of embedding API calls for cache misses."),
+    "embeddings_per_second": ("histogram", "Texts embedded per second per embedding API call."),
+    "ingest_stage_duration_seconds": ("histogram", "Latency of each ingestion stage."),
+    "ingest_rows_per_second": ("histogram", "Order rows read per second per ingestion."),
+    "ingestions_total": ("counter", "Ingestion runs by result."),
+}
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms rendered in the Prometheus text format. Values are per worker process."""
+
+    def __init__(self, descriptions: Dict[str, tuple]):
+        self.descriptions = descriptions
+        self._lock = threading.Lock()
+        self._counters: Dict[tuple, float] = {}
+        self._histograms: Dict[tuple, Dict[str, Any]] = {}
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def observe(self, name: str, value: float, buckets: Sequence[float] = LATENCY_BUCKETS, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {"buckets": tuple(buckets), "counts": [0] * (len(buckets) + 1), "sum": 0.0}
+            histogram["counts"][bisect.bisect_left(histogram["buckets"], value)] += 1
+            histogram["sum"] += value
+
+    @staticmethod
+    def _format_labels(labels: Sequence[tuple]) -> str:
+        if not labels:
+            return ""
+        escaped = [(key, str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for key, value in labels]
+        return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+    def render(self) -> str:
+        with self._lock:
+            counters = dict(self._counters)
+            histograms = {key: dict(histogram, counts=list(histogram["counts"])) for key, histogram in self._histograms.items()}
+        lines = []
+        for name in sorted({key[0] for key in counters} | {key[0] for key in histograms}):
+            metric_type, help_text = self.descriptions.get(name, ("untyped", name))
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+            for (_, labels), value in sorted((item for item in counters.items() if item[0][0] == name), key=lambda item: item[0]):
+                lines.append(f"{name}{self._format_labels(labels)} {float(value)}")
+            for (_, labels), histogram in sorted((item for item in histograms.items() if item[0][0] == name), key=lambda item: item[0]):
+                cumulative = 0
+                for bound, count in zip(histogram["buckets"] + (math.inf,), histogram["counts"]):
+                    cumulative += count
+                    le = "+Inf" if bound == math.inf else f"{float(bound)}"
+                    lines.append(f"{name}_bucket{self._format_labels(labels + (('le', le),))} {cumulative}")
+                lines.append(f"{name}_sum{self._format_labels(labels)} {histogram['sum']}")
+                lines.append(f"{name}_count{self._format_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry(METRIC_DESCRIPTIONS)
+
+class RequestTrace:
+    """Stage timings of one HTTP request, reported to metrics, the Server-Timing header and the slow-request log."""
+
+    def __init__(self, request_id: str, route: str, method: str):
+        self.request_id = request_id
+        self.route = route
+        self.method = method
+        self.started_at = time.perf_counter()
+        self.stages: List[tuple] = []
+        self.streaming = False
+        self.finished = False
+
+    def record(self, stage: str, seconds: float):
+        self.stages.append((stage, seconds))
+        metrics.observe("bundle_stage_duration_seconds", seconds, route=self.route, stage=stage)
+
+    def server_timing_header(self) -> str:
+        # Stages that ran several times (batch prompts, retries) are summed into one entry.
+        totals: Dict[str, List[float]] = {}
+        for stage, seconds in self.stages:
+            total = totals.setdefault(stage, [0.0, 0])
+            total[0] += seconds
+            total[1] += 1
+        entries = [f"{stage};dur={seconds * 1000:.1f}" + (f';desc="{calls} calls"' if calls > 1 else "")
+                   for stage, (seconds, calls) in totals.items()]
+        entries.append(f"total;dur={(time.perf_counter() - self.started_at) * 1000:.1f}")
+        return ", ".join(entries)
+
+    def finish(self, status_code: int):
+        if self.finished:
+            return
+        self.finished = True
+        elapsed = time.perf_counter() - self.started_at
+        metrics.observe("http_request_duration_seconds", elapsed, route=self.route, method=self.method, status=str(status_code))
+        if SLOW_REQUEST_LOG_SECONDS > 0 and elapsed >= SLOW_REQUEST_LOG_SECONDS:
+            breakdown = ", ".join(f"{stage}={seconds * 1000:.0f}ms" for stage, seconds in self.stages) or "no stages recorded"
+            app.logger.warning(f"Slow request {self.request_id}: {self.method} {self.route} -> {status_code} in {elapsed:.2f}s ({breakdown}).")
+
+def current_trace() -> Optional[RequestTrace]:
+    return g.get("trace") if has_request_context() else None
+
+@contextmanager
+def trace_stage(stage: str, trace: Optional[RequestTrace] = None):
+    """Times the block as a stage of the current request, or of `trace` when running on a worker thread."""
+    trace = trace or current_trace()
+    started_at = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started_at
+        if trace is not None:
+            trace.record(stage, elapsed)
+        else:
+            metrics.observe("bundle_stage_duration_seconds", elapsed, route="background", stage=stage)
+
 
 class BundleOutput(BaseModel):
     bundle_name: str = Field(..., description="Descriptive name for the product bundle (e.g., 'Summer Skincare Essentials Pack')")
@@ -69,87 +275,761 @@ class BundleOutput(BaseModel):
     result: str = Field(..., description="A statement on the expected outcome or impact of this bundle.")
     recommended_duration_notes: Optional[str] = Field(default=None, description="Notes on recommended availability period based on stock or seasonality. Could include structured dates like 'Start:YYYY-MM-DD, End:YYYY-MM-DD'.")
 
+class PersistentEmbeddingCache:
+    """On-disk LRU cache of embedding vectors keyed by (model name, normalized text hash)."""
+    _SQL_VARIABLE_CHUNK = 500
+
+    def __init__(self, db_path: str, max_entries: int):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(model_name: str, text: str) -> str:
+        normalized_text = " ".join(text.split())
+        return hashlib.sha256(f"{model_name}\x1f{normalized_text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, List[float]]:
+        unique_keys = list(dict.fromkeys(keys))
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            for start in range(0, len(unique_keys), self._SQL_VARIABLE_CHUNK):
+                chunk = unique_keys[start:start + self._SQL_VARIABLE_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                for key, blob in self._conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", chunk):
+                    vector = array("f")
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found])
+                self._conn.commit()
+            self.hits += len(found)
+            self.misses += len(unique_keys) - len(found)
+        return found
+
+    def put_many(self, items: Dict[str, Sequence[float]]):
+        if not items:
+            return
+        now = time.time()
+        rows = [(key, array("f", vector).tobytes(), now) for key, vector in items.items()]
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)", rows)
+            (entry_count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+            overflow = entry_count - self.max_entries
+            if overflow > 0:
+                self._conn.execute("DELETE FROM embeddings WHERE key IN (SELECT key FROM embeddings ORDER BY last_used ASC LIMIT ?)", (overflow,))
+                app.logger.info(f"Embedding cache evicted {overflow} least recently used entries.")
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            (entry_count,) = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "entries": entry_count, "max_entries": self.max_entries}
+
+class CachedEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Chroma embedding function that only sends cache misses to the wrapped (remote) embedding function."""
+
+    def __init__(self, inner: EmbeddingFunction, cache: PersistentEmbeddingCache, model_name: str):
+        self._inner = inner
+        self._cache = cache
+        self._model_name = model_name
+
+    def __call__(self, input: Documents) -> Embeddings:
+        keys = [self._cache.make_key(self._model_name, text) for text in input]
+        vectors_by_key = self._cache.get_many(keys)
+        missing_texts_by_key = {key: text for key, text in zip(keys, input) if key not in vectors_by_key}
+        metrics.inc("embedding_cache_lookups_total", len(vectors_by_key), result="hit")
+        metrics.inc("embedding_cache_lookups_total", len(missing_texts_by_key), result="miss")
+        if missing_texts_by_key:
+            missing_keys = list(missing_texts_by_key)
+            started_at = time.perf_counter()
+            new_vectors = self._inner([missing_texts_by_key[key] for key in missing_keys])
+            elapsed = time.perf_counter() - started_at
+            metrics.observe("embedding_request_duration_seconds", elapsed)
+            if elapsed > 0:
+                metrics.observe("embeddings_per_second", len(missing_keys) / elapsed, buckets=THROUGHPUT_BUCKETS)
+            new_items = dict(zip(missing_keys, new_vectors))
+            self._cache.put_many(new_items)
+            vectors_by_key.update(new_items)
+        return [vectors_by_key[key] for key in keys]
+
+    # Report the wrapped function's identity so Chroma's persisted collection config stays compatible.
+    def name(self) -> str:
+        return self._inner.name()
+
+    def get_config(self) -> Dict[str, Any]:
+        return self._inner.get_config()
+
+    def build_from_config(self, config: Dict[str, Any]) -> EmbeddingFunction:
+        return self._inner.build_from_config(config)
+
+    def default_space(self):
+        return self._inner.default_space()
+
+    def supported_spaces(self):
+        return self._inner.supported_spaces()
+
+def load_ingest_state() -> Dict[str, Any]:
+    try:
+        with open(INGEST_STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        app.logger.warning(f"Could not read ingest state '{INGEST_STATE_FILE}': {e}. Treating as empty.")
+        return {}
+
+def save_ingest_state(state: Dict[str, Any]):
+    tmp_path = INGEST_STATE_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, INGEST_STATE_FILE)
+
+def _process_is_alive(pid: int) -> bool:
+    if os.name == "nt":  # os.kill(pid, 0) sends CTRL_C_EVENT on Windows; assume the worker is still running.
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+class SharedIngestState:
+    """State every WSGI worker process must agree on, in a sqlite file next to the ingest state: which catalog
+    generations each process still uses, and the ingestion jobs so any worker can report their status."""
+
+    def __init__(self, db_path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS catalog_users (pid INTEGER NOT NULL, collection_name TEXT NOT NULL, PRIMARY KEY (pid, collection_name))")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS ingestion_jobs (job_id TEXT PRIMARY KEY, job TEXT NOT NULL, submitted_at REAL NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS catalog_generations (id INTEGER PRIMARY KEY CHECK (id = 1), last_generation INTEGER NOT NULL)")
+        self._conn.commit()
+
+    def reset_process(self, pid: int):
+        """Forgets rows of an earlier process that had the same pid (e.g. after a container restart)."""
+        with self._lock:
+            self._conn.execute("DELETE FROM catalog_users WHERE pid = ?", (pid,))
+            self._conn.commit()
+
+    def add_catalog_user(self, pid: int, collection_name: str):
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO catalog_users (pid, collection_name) VALUES (?, ?)", (pid, collection_name))
+            self._conn.commit()
+
+    def reserve_catalog_generation(self, pid: int, name_prefix: str, min_generation: int) -> str:
+        """Hands out a generation name no other process has been given and registers `pid` as its user, so the
+        generation is not dropped as an orphan while it is being built."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT last_generation FROM catalog_generations WHERE id = 1").fetchone()
+                generation = max(row[0] if row else 0, min_generation) + 1
+                collection_name = f"{name_prefix}{generation}"
+                self._conn.execute("INSERT OR REPLACE INTO catalog_generations (id, last_generation) VALUES (1, ?)", (generation,))
+                self._conn.execute("INSERT OR IGNORE INTO catalog_users (pid, collection_name) VALUES (?, ?)", (pid, collection_name))
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        return collection_name
+
+    def release_catalog(self, pid: int, collection_name: str) -> bool:
+        """Removes this process from the users of `collection_name`; True if no live process uses it anymore."""
+        with self._lock:
+            self._conn.execute("DELETE FROM catalog_users WHERE pid = ? AND collection_name = ?", (pid, collection_name))
+            self._conn.commit()
+        return not self.has_other_users(pid, collection_name)
+
+    def has_other_users(self, pid: int, collection_name: str) -> bool:
+        """True if a live process other than `pid` uses `collection_name`; rows of exited processes are pruned."""
+        with self._lock:
+            other_pids = [row[0] for row in self._conn.execute("SELECT pid FROM catalog_users WHERE collection_name = ? AND pid != ?",
+                                                               (collection_name, pid))]
+            dead_pids = [other_pid for other_pid in other_pids if not _process_is_alive(other_pid)]
+            if dead_pids:
+                self._conn.executemany("DELETE FROM catalog_users WHERE pid = ?", [(dead_pid,) for dead_pid in dead_pids])
+                self._conn.commit()
+        return len(other_pids) > len(dead_pids)
+
+    def save_job(self, job: Dict[str, Any], max_jobs: int):
+        job_json = json.dumps(dict(job))
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO ingestion_jobs (job_id, job, submitted_at) VALUES (?, ?, ?)",
+                               (job["job_id"], job_json, job["submitted_at"]))
+            self._conn.execute("DELETE FROM ingestion_jobs WHERE job_id NOT IN (SELECT job_id FROM ingestion_jobs ORDER BY submitted_at DESC LIMIT ?)", (max_jobs,))
+            self._conn.commit()
+
+    def load_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT job FROM ingestion_jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+class BundleResponseCache:
+    """In-memory TTL/LRU cache of LLM bundle responses with an exact-prompt tier and a prompt-embedding similarity tier.
+
+    Entries are scoped by (model name, prompt template version, catalog generation, retrieved SKU set), so a
+    response is only reused when the LLM would have seen the same context.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float, similarity_threshold: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _exact_key(scope: tuple, user_input: str) -> str:
+        normalized_prompt = " ".join(user_input.lower().split())
+        return hashlib.sha256(json.dumps([list(map(str, scope)), normalized_prompt]).encode("utf-8")).hexdigest()
+
+    def _drop_expired(self, now: float):
+        expired_keys = [key for key, entry in self._entries.items() if now - entry["stored_at"] > self.ttl_seconds]
+        for key in expired_keys:
+            del self._entries[key]
+
+    def get(self, scope: tuple, user_input: str, prompt_embedding: Optional[Sequence[float]]):
+        """Returns (cached result or None, "exact" | "semantic" | "miss")."""
+        now = time.time()
+        with self._lock:
+            self._drop_expired(now)
+            exact_key = self._exact_key(scope, user_input)
+            entry = self._entries.get(exact_key)
+            if entry is not None:
+                self._entries.move_to_end(exact_key)
+                self.exact_hits += 1
+                metrics.inc("bundle_response_cache_lookups_total", result="exact")
+                return copy.deepcopy(entry["result"]), "exact"
+
+            if prompt_embedding is not None:
+                query_vector = np.asarray(prompt_embedding, dtype=np.float32)
+                query_norm = float(np.linalg.norm(query_vector))
+                best_key, best_similarity = None, self.similarity_threshold
+                for key, candidate in self._entries.items():
+                    if candidate["scope"] != scope or candidate["embedding"] is None or query_norm == 0.0:
+                        continue
+                    similarity = float(np.dot(query_vector, candidate["embedding"]) / (query_norm * candidate["embedding_norm"]))
+                    if similarity >= best_similarity:
+                        best_key, best_similarity = key, similarity
+                if best_key is not None:
+                    self._entries.move_to_end(best_key)
+                    self.semantic_hits += 1
+                    metrics.inc("bundle_response_cache_lookups_total", result="semantic")
+                    app.logger.info(f"Semantic response cache hit (cosine {best_similarity:.4f}).")
+                    return copy.deepcopy(self._entries[best_key]["result"]), "semantic"
+
+            self.misses += 1
+            metrics.inc("bundle_response_cache_lookups_total", result="miss")
+            return None, "miss"
+
+    def put(self, scope: tuple, user_input: str, prompt_embedding: Optional[Sequence[float]], result: Dict[str, Any]):
+        embedding = np.asarray(prompt_embedding, dtype=np.float32) if prompt_embedding is not None else None
+        embedding_norm = float(np.linalg.norm(embedding)) if embedding is not None else 0.0
+        with self._lock:
+            exact_key = self._exact_key(scope, user_input)
+            self._entries[exact_key] = {
+                "scope": scope, "embedding": embedding if embedding_norm else None, "embedding_norm": embedding_norm,
+                "result": copy.deepcopy(result), "stored_at": time.time(),
+            }
+            self._entries.move_to_end(exact_key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"exact_hits": self.exact_hits, "semantic_hits": self.semantic_hits, "misses": self.misses,
+                    "entries": len(self._entries), "max_entries": self.max_entries}
+
+bundle_response_cache = BundleResponseCache(
+    LLM_RESPONSE_CACHE_MAX_ENTRIES, LLM_RESPONSE_CACHE_TTL_SECONDS, LLM_RESPONSE_CACHE_SIMILARITY_THRESHOLD
+)
+
+class TokenRateLimiter:
+    """Token bucket shared by concurrent LLM calls to stay under a tokens-per-minute budget."""
+
+    def __init__(self, tokens_per_minute: int):
+        self.capacity = float(tokens_per_minute)
+        self.available = float(tokens_per_minute)
+        self.refill_per_second = tokens_per_minute / 60.0
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: int):
+        if self.capacity <= 0:
+            return
+        tokens = min(float(tokens), self.capacity)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.available = min(self.capacity, self.available + (now - self._updated_at) * self.refill_per_second)
+                self._updated_at = now
+                if self.available >= tokens:
+                    self.available -= tokens
+                    return
+                wait_seconds = (tokens - self.available) / self.refill_per_second
+            time.sleep(wait_seconds)
+
+class CoPurchaseIndex:
+    """Sparse SKU x SKU co-occurrence counts from order baskets, with support, confidence and lift per pair.
+
+    Pairs are stored in both directions, sorted by source SKU, so all partners of a SKU are one contiguous slice.
+    """
+    METRICS = ("lift", "confidence", "support", "co_orders")
+
+    def __init__(self, skus: np.ndarray, sku_names: np.ndarray, sku_order_counts: np.ndarray, num_orders: int,
+                 pair_src: np.ndarray, pair_dst: np.ndarray, pair_counts: np.ndarray):
+        self.skus = skus
+        self.sku_names = sku_names
+        self.sku_order_counts = sku_order_counts
+        self.num_orders = num_orders
+        self.pair_src = pair_src
+        self.pair_dst = pair_dst
+        self.pair_counts = pair_counts
+        self._sku_positions = {sku: i for i, sku in enumerate(skus.tolist())}
+
+    @classmethod
+    def build(cls, skus: List[str], sku_names: List[str], basket_order_numbers: List[str], basket_sku_indices: List[int],
+              min_co_orders: int = COPURCHASE_MIN_CO_ORDERS, max_basket_size: int = COPURCHASE_MAX_BASKET_SIZE) -> "CoPurchaseIndex":
+        """Builds the index from the (order, SKU) incidence pairs; each (order, SKU) pair must appear once. Orders are
+        given as order numbers or as integer order codes."""
+        sku_idx = np.asarray(basket_sku_indices, dtype=np.int64)
+        basket_orders = np.asarray(basket_order_numbers)
+        if basket_orders.dtype == object:
+            basket_orders = basket_orders.astype(str)
+        _, order_idx = np.unique(basket_orders, return_inverse=True)
+        order_idx = order_idx.astype(np.int64)
+        num_orders = int(order_idx.max()) + 1 if order_idx.size else 0
+        sku_order_counts = np.bincount(sku_idx, minlength=len(skus)).astype(np.int64)
+
+        basket_sizes = np.bincount(order_idx, minlength=num_orders)
+        keep = basket_sizes[order_idx] <= max_basket_size
+        order_idx, sku_idx = order_idx[keep], sku_idx[keep]
+        sort_order = np.lexsort((sku_idx, order_idx))
+        order_idx, sku_idx = order_idx[sort_order], sku_idx[sort_order]
+
+        # Rows of the same order are adjacent, so pairs within a basket are (row, row + offset) for every
+        # offset below the largest kept basket size.
+        pair_codes = []
+        largest_basket = int(basket_sizes[basket_sizes <= max_basket_size].max()) if num_orders and keep.any() else 0
+        num_skus = np.int64(len(skus))
+        for offset in range(1, largest_basket):
+            same_order = order_idx[:-offset] == order_idx[offset:]
+            if not same_order.any():
+                break
+            pair_codes.append(sku_idx[:-offset][same_order] * num_skus + sku_idx[offset:][same_order])
+        if pair_codes:
+            unique_codes, counts = np.unique(np.concatenate(pair_codes), return_counts=True)
+            frequent = counts >= min_co_orders
+            unique_codes, counts = unique_codes[frequent], counts[frequent]
+            first, second = unique_codes // num_skus, unique_codes % num_skus
+        else:
+            first = second = counts = np.empty(0, dtype=np.int64)
+
+        pair_src = np.concatenate([first, second])
+        pair_dst = np.concatenate([second, first])
+        pair_counts = np.concatenate([counts, counts]).astype(np.int64)
+        by_src = np.argsort(pair_src, kind="stable")
+        return cls(np.asarray(skus, dtype=str), np.asarray(sku_names, dtype=str), sku_order_counts, num_orders,
+                   pair_src[by_src], pair_dst[by_src], pair_counts[by_src])
+
+    def save(self, path: str):
+        tmp_path = path + ".tmp.npz"
+        np.savez_compressed(tmp_path, skus=self.skus, sku_names=self.sku_names, sku_order_counts=self.sku_order_counts,
+                            num_orders=np.int64(self.num_orders), pair_src=self.pair_src, pair_dst=self.pair_dst,
+                            pair_counts=self.pair_counts)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "CoPurchaseIndex":
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data["skus"], data["sku_names"], data["sku_order_counts"], int(data["num_orders"]),
+                       data["pair_src"], data["pair_dst"], data["pair_counts"])
+
+    @property
+    def num_pairs(self) -> int:
+        return len(self.pair_src) // 2
+
+    def partners(self, sku: str, limit: int = 10, metric: str = "lift") -> List[Dict[str, Any]]:
+        position = self._sku_positions.get(sku)
+        if position is None or self.num_orders == 0:
+            return []
+        start, end = np.searchsorted(self.pair_src, [position, position + 1])
+        if start == end:
+            return []
+        partner_idx = self.pair_dst[start:end]
+        co_orders = self.pair_counts[start:end].astype(np.float64)
+        support = co_orders / self.num_orders
+        confidence = co_orders / self.sku_order_counts[position]
+        lift = confidence / (self.sku_order_counts[partner_idx] / self.num_orders)
+        scores = {"lift": lift, "confidence": confidence, "support": support, "co_orders": co_orders}[metric]
+        top = np.argsort(-scores, kind="stable")[:limit]
+        return [{"sku": str(self.skus[partner_idx[k]]), "name": str(self.sku_names[partner_idx[k]]),
+                 "co_orders": int(co_orders[k]), "support": round(float(support[k]), 6),
+                 "confidence": round(float(confidence[k]), 6), "lift": round(float(lift[k]), 3)} for k in top]
+
+copurchase_index: Optional[CoPurchaseIndex] = None
+
+def tokenize_for_search(text: str) -> List[str]:
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+class LexicalIndex:
+    """In-process BM25 index over product titles and BaseSKUs, plus the price/category/sales fields used for filtering."""
+    K1 = 1.2
+    B = 0.75
+
+    def __init__(self, docs: List[Dict[str, Any]]):
+        self.docs = docs
+        self.postings: Dict[str, List[tuple]] = {}
+        self.doc_lengths = np.zeros(len(docs), dtype=np.float64)
+        for doc_idx, doc in enumerate(docs):
+            terms = tokenize_for_search(f"{doc['name']} {doc['sku']}")
+            self.doc_lengths[doc_idx] = len(terms)
+            term_counts: Dict[str, int] = {}
+            for term in terms:
+                term_counts[term] = term_counts.get(term, 0) + 1
+            for term, count in term_counts.items():
+                self.postings.setdefault(term, []).append((doc_idx, count))
+        self.avg_doc_length = float(self.doc_lengths.mean()) if len(docs) else 0.0
+        self.categories = sorted({doc["category"] for doc in docs if doc["category"] and doc["category"] != "N/A"})
+
+    @classmethod
+    def from_metadatas(cls, metadatas: List[Dict[str, Any]]) -> "LexicalIndex":
+        return cls([{"sku": m["BaseSKU"], "name": m["ProductName"], "price": m["Price"], "category": m["Category"],
+                     "total_sold": m.get("TotalSold", 0)} for m in metadatas])
+
+    def save(self, path: str):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.docs, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> "LexicalIndex":
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def search(self, query: str, limit: int, constraints: Dict[str, Any]) -> List[str]:
+        """Returns BaseSKUs of the best BM25 matches that satisfy `constraints`, best first."""
+        if not self.docs:
+            return []
+        scores: Dict[int, float] = {}
+        num_docs = len(self.docs)
+        for term in set(tokenize_for_search(query)):
+            term_postings = self.postings.get(term)
+            if not term_postings:
+                continue
+            idf = math.log(1 + (num_docs - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+            for doc_idx, term_count in term_postings:
+                length_norm = 1 - self.B + self.B * self.doc_lengths[doc_idx] / (self.avg_doc_length or 1.0)
+                scores[doc_idx] = scores.get(doc_idx, 0.0) + idf * term_count * (self.K1 + 1) / (term_count + self.K1 * length_norm)
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return [self.docs[doc_idx]["sku"] for doc_idx, _ in ranked
+                if product_matches_constraints(self.docs[doc_idx], constraints)][:limit]
+
+lexical_index: Optional[LexicalIndex] = None
+
+_PRICE_NUMBER = r"(?:€|eur|euros?)?\s*(\d+(?:[.,]\d+)?)\s*(?:€|eur|euros?)?"
+_PRICE_RANGE_PATTERNS = [
+    (re.compile(r"(?:between|from)\s*" + _PRICE_NUMBER + r"\s*(?:and|to|-|–)\s*" + _PRICE_NUMBER), "range"),
+    (re.compile(r"€\s*(\d+(?:[.,]\d+)?)\s*(?:-|–|to)\s*€?\s*(\d+(?:[.,]\d+)?)"), "range"),
+    (re.compile(r"(?:under|below|less than|cheaper than|up to|at most|max(?:imum)?|<)\s*" + _PRICE_NUMBER), "max"),
+    (re.compile(r"(?:over|above|more than|at least|min(?:imum)?|>)\s*" + _PRICE_NUMBER), "min"),
+]
+_PRICE_CURRENCY_PATTERN = re.compile(r"€|\beur")
+# A bare number after "up to"/"over" is only a price with a currency marker or a price word in front:
+# "up to 3 products" and "over 2 weeks" are not price bounds, "priced up to 30" and "over 20€" are.
+_PRICE_WORD_BEFORE_PATTERN = re.compile(r"\b(?:price[ds]?|priced at|costs?|costing|budget(?:\s+(?:of|is))?|spend(?:ing)?)\s*$")
+_POPULARITY_PATTERN = re.compile(r"\b(?:popular|best[- ]?sell(?:ing|ers?)|top[- ]?sell(?:ing|ers?)|most sold|bestsellers?)\b")
+
+def singular_search_term(term: str) -> str:
+    """Crude singular form for matching prompts to categories: "supplies" -> "supply", "gifts" -> "gift"."""
+    if len(term) > 4 and term.endswith("ies"):
+        return term[:-3] + "y"
+    return term.rstrip("s")
+
+def extract_query_constraints(user_input: str, known_categories: List[str]) -> Dict[str, Any]:
+    """Pulls price bounds, catalog categories and a popularity flag out of a free-text prompt."""
+    text = user_input.lower()
+    constraints: Dict[str, Any] = {}
+    for pattern, kind in _PRICE_RANGE_PATTERNS:
+        match = next((m for m in pattern.finditer(text)
+                      if _PRICE_CURRENCY_PATTERN.search(m.group(0)) or _PRICE_WORD_BEFORE_PATTERN.search(text[:m.start()])), None)
+        if not match:
+            continue
+        values = [float(v.replace(",", ".")) for v in match.groups()]
+        if kind == "range":
+            constraints.setdefault("min_price", min(values)); constraints.setdefault("max_price", max(values))
+        elif kind == "max":
+            constraints.setdefault("max_price", values[0])
+        else:
+            constraints.setdefault("min_price", values[0])
+
+    prompt_terms = {singular_search_term(term) for term in tokenize_for_search(text)}
+    matched_categories = [
+        category for category in known_categories
+        if (category_terms := {singular_search_term(term) for term in tokenize_for_search(category)}) and category_terms <= prompt_terms
+    ]
+    if matched_categories:
+        constraints["categories"] = matched_categories
+    if _POPULARITY_PATTERN.search(text):
+        constraints["popular"] = True
+    return constraints
+
+def constraints_to_chroma_where(constraints: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    conditions = []
+    if "min_price" in constraints:
+        conditions.append({"Price": {"$gte": constraints["min_price"]}})
+    if "max_price" in constraints:
+        conditions.append({"Price": {"$lte": constraints["max_price"]}})
+    if constraints.get("categories"):
+        conditions.append({"Category": {"$in": constraints["categories"]}})
+    # "popular" is not a filter: it boosts best sellers in retrieve_bundle_contexts instead.
+    if not conditions:
+        return None
+    return conditions[0] if len(conditions) == 1 else {"$and": conditions}
+
+def product_matches_constraints(product: Dict[str, Any], constraints: Dict[str, Any]) -> bool:
+    """Python twin of constraints_to_chroma_where for lexical-index docs ("price"...) and Chroma metadata ("Price"...)."""
+    price = product.get("price", product.get("Price"))
+    category = product.get("category", product.get("Category"))
+    if "min_price" in constraints and (not isinstance(price, (int, float)) or price < constraints["min_price"]):
+        return False
+    if "max_price" in constraints and (not isinstance(price, (int, float)) or price > constraints["max_price"]):
+        return False
+    if constraints.get("categories") and category not in constraints["categories"]:
+        return False
+    return True
+
+def reciprocal_rank_fusion(rankings: List[List[str]], k: int = RRF_K) -> List[str]:
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking):
+            scores[item_id] = scores.get(item_id, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores, key=lambda item_id: scores[item_id], reverse=True)
+
+_token_encodings: Dict[str, Any] = {}
+
+def count_tokens(text: str, model_name: Optional[str] = None) -> int:
+    """Counts tokens with the model's tiktoken encoding, or estimates ~4 characters per token without it."""
+    model_name = model_name or getattr(model, "model_name", "") or "gpt-3.5-turbo"
+    if tiktoken is not None and model_name not in _token_encodings:
+        try:
+            _token_encodings[model_name] = tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            _token_encodings[model_name] = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:  # e.g. the BPE file cannot be downloaded
+            app.logger.warning(f"tiktoken unavailable for '{model_name}' ({e}). Estimating token counts.")
+            _token_encodings[model_name] = None
+    encoding = _token_encodings.get(model_name)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text))
+
+def context_token_budget(model_name: Optional[str] = None) -> int:
+    if LLM_CONTEXT_TOKEN_BUDGET_OVERRIDE > 0:
+        return LLM_CONTEXT_TOKEN_BUDGET_OVERRIDE
+    return LLM_CONTEXT_TOKEN_BUDGETS.get(model_name or getattr(model, "model_name", ""), 1500)
+
+def _compact_cell(value: Any) -> str:
+    return " ".join(str(value).replace("|", "/").split())
+
+def _compact_sales_note(metadata: Dict[str, Any]) -> str:
+    note = metadata.get("SalesMetrics", "Sales data N/A")
+    return note.replace("Sales: ", "").replace(" units in ", " units/").replace(" orders.", " orders").replace(" (No sales in this data)", " (No sales)")
+
+def build_compact_product_context(metadatas: List[Dict[str, Any]], token_budget: int):
+    """Renders products as a pipe-separated table in rank order until the token budget is spent.
+
+    Columns whose value is the same for every product (stock placeholder, single category) become one note line.
+    Returns (context text, metadatas actually included, context token count).
+    """
+    notes = []
+    columns = [("BaseSKU", lambda m: m.get("BaseSKU", "N/A")), ("Product Name", lambda m: m.get("ProductName", f"Product {m.get('BaseSKU', 'N/A')}")),
+               ("Price €", lambda m: f"{m['Price']:.2f}" if isinstance(m.get("Price"), (int, float)) else "N/A")]
+    categories = {m.get("Category", "N/A") for m in metadatas}
+    if len(categories) == 1:
+        notes.append(f"Category for all products: {categories.pop()}")
+    else:
+        columns.append(("Category", lambda m: m.get("Category", "N/A")))
+    columns.append(("Sales", _compact_sales_note))
+    stock_infos = {m.get("StockInfo", "Stock data N/A") for m in metadatas}
+    if len(stock_infos) == 1:
+        notes.append(f"Stock for all products: {stock_infos.pop()}")
+    else:
+        columns.append(("Stock", lambda m: m.get("StockInfo", "Stock data N/A")))
+    bought_with = {}
+    if copurchase_index is not None:
+        for m in metadatas:
+            partners = copurchase_index.partners(m.get("BaseSKU", ""), limit=COPURCHASE_PARTNERS_PER_SEED)
+            if partners:
+                bought_with[m.get("BaseSKU")] = " ".join(partner["sku"] for partner in partners)
+    if bought_with:
+        columns.append(("Often Bought With", lambda m: bought_with.get(m.get("BaseSKU"), "")))
+
+    lines = notes + [" | ".join(name for name, _ in columns)]
+    used_tokens = count_tokens("\n".join(lines))
+    included = []
+    for metadata in metadatas:
+        line = " | ".join(_compact_cell(value_of(metadata)) for _, value_of in columns)
+        line_tokens = count_tokens(line) + 1
+        if included and used_tokens + line_tokens > token_budget:
+            break
+        lines.append(line)
+        used_tokens += line_tokens
+        included.append(metadata)
+    return "\n".join(lines), included, used_tokens
+
+llm_rate_limiter = TokenRateLimiter(LLM_TOKENS_PER_MINUTE)
+llm_executor = ThreadPoolExecutor(max_workers=LLM_BATCH_MAX_CONCURRENCY, thread_name_prefix="llm")
+
 lc_openai_embeddings = None
+embedding_cache = None
 chroma_openai_ef = None
 chroma_client = None
 product_collection = None
-model = None
-chain = None
+active_collection_name = CHROMA_COLLECTION_NAME
+shared_state: Optional[SharedIngestState] = None
+BUNDLE_PROMPT_TEMPLATE = """
+    You are a data bot that creates bundle-ready JSON for ecommerce managers, pricing bundles in euros (€) for a European context.
 
-try:
+    Product data (one row per product, columns as in the header row):
+    {context}
 
-    lc_openai_embeddings = OpenAIEmbeddings()
-    app.logger.info("LangChain OpenAIEmbeddings initialized.")
+    Rules:
+    1. 'products' must use the exact Product Name of each chosen BaseSKU; 'skus' holds those BaseSKUs.
+    2. 'products', 'skus', 'price_per_product', 'product_stock_levels' and 'product_sales_metrics' have the same length and order.
+    3. 'price_per_product' uses the listed prices; 'original_total_price' is their sum; 'total_price' applies 'discount_percent' to it.
+    4. Without cost data, 'margin' is the string 'Estimated due to lack of cost data'; otherwise a number, with 'margin_type' 'percentage' or 'absolute_eur'.
+    5. 'recommended_duration_notes': use 'Start:YYYY-MM-DD, End:YYYY-MM-DD' or 'Duration: X days/weeks from YYYY-MM-DD' when dates can be inferred from stock, seasonality or the request; otherwise general notes.
 
-    if "OPENAI_API_KEY" not in os.environ or not os.environ["OPENAI_API_KEY"]:
-        raise ValueError("OPENAI_API_KEY not found or empty in environment variables for ChromaDB embedding function.")
-    chroma_openai_ef = embedding_functions.OpenAIEmbeddingFunction(
-        api_key=os.environ["OPENAI_API_KEY"],
-        model_name="text-embedding-ada-002"
-    )
-    app.logger.info("ChromaDB OpenAIEmbeddingFunction initialized.")
+    User input: {user_input}
 
-    chroma_client = chromadb.PersistentClient(path=CHROMA_PERSIST_DIR)
-    app.logger.info(f"ChromaDB PersistentClient initialized at {CHROMA_PERSIST_DIR}")
-    product_collection = chroma_client.get_or_create_collection(
-        name=CHROMA_COLLECTION_NAME,
-        embedding_function=chroma_openai_ef
-    )
-    app.logger.info(f"ChromaDB collection '{CHROMA_COLLECTION_NAME}' loaded/created.")
+    Return only a JSON object with keys: bundle_name (str), products (list[str]), skus (list[str]), price_per_product (list[float]), product_stock_levels (list[str]), product_sales_metrics (list[str]), total_price (float), original_total_price (float), discount_percent (float), trend (str), margin (float or str), margin_type (str), summary (str, justify with data insights), result (str, expected impact), recommended_duration_notes (str).
+    """
 
+model = None
+prompt = None
+chain = None
+component_status: Dict[str, str] = {"embeddings": "pending", "chroma": "pending", "indexes": "pending", "llm": "pending"}
+components_lock = threading.Lock()
+components_pid: Optional[int] = None  # Only set once initialization succeeded in this process.
+components_attempt: Dict[str, Any] = {"pid": None, "retry_at": 0.0}
 
-    valid_models = ["gpt-4", "gpt-4-turbo", "gpt-3.5-turbo"]
-    model_name = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+def components_ready() -> bool:
+    return all(status == "ready" for status in component_status.values())
+
+def init_components() -> bool:
+    """Builds the OpenAI clients, Chroma client/collection, persisted indexes and LLM chain once per process.
+    Called lazily before requests; a forked worker re-initializes rather than reusing its parent's clients. A failed
+    initialization (e.g. a briefly locked Chroma file or a missing key) is retried by a request after a backoff."""
+    global components_pid, lc_openai_embeddings, embedding_cache, chroma_openai_ef, chroma_client, product_collection
+    global active_collection_name, catalog_indexes_file_hash, copurchase_index, lexical_index, model, prompt, chain, shared_state
+    if components_pid == os.getpid():
+        return components_ready()
+    if components_attempt["pid"] == os.getpid() and time.monotonic() < components_attempt["retry_at"]:
+        return False
+    with components_lock:
+        if components_pid == os.getpid():
+            return components_ready()
+        if components_attempt["pid"] == os.getpid() and time.monotonic() < components_attempt["retry_at"]:
+            return False
+        started = time.perf_counter()
+        for name in component_status:
+            component_status[name] = "pending"
+        step = None
+        try:
+            step = "embeddings"
+            if "OPENAI_API_KEY" not in os.environ or not os.environ["OPENAI_API_KEY"]:
+                raise ValueError("OPENAI_API_KEY not found or empty in environment variables for ChromaDB embedding function.")
+            embedding_cache = PersistentEmbeddingCache(EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES)
+            chroma_openai_ef = CachedEmbeddingFunction(
+                embedding_functions.OpenAIEmbeddingFunction(
+                    api_key=os.environ["OPENAI_API_KEY"],
+                    model_name=EMBEDDING_MODEL_NAME
+                ),
+                embedding_cache,
+                EMBEDDING_MODEL_NAME
+            )
+            app.logger.info(f"ChromaDB OpenAIEmbeddingFunction initialized with embedding cache at {EMBEDDING_CACHE_PATH}.")
+            lc_openai_embeddings = OpenAIEmbeddings()
+            app.logger.info("LangChain OpenAIEmbeddings initialized.")
+            component_status[step] = "ready"
 
-    if model_name not in valid_models:
-        raise ValueError(f"Invalid model name: {model_name}. Must be one of {valid_models}")
-    
-    app.logger.info(f"Using OpenAI model: {model_name}")
+            step = "chroma"
+            chroma_client = chromadb.PersistentClient(path=CHROMA_PERSIST_DIR)
+            app.logger.info(f"ChromaDB PersistentClient initialized at {CHROMA_PERSIST_DIR}")
+            shared_state = SharedIngestState(SHARED_STATE_PATH)
+            shared_state.reset_process(os.getpid())
+            ingest_state = load_ingest_state()
+            active_collection_name = ingest_state.get("active_collection", CHROMA_COLLECTION_NAME)
+            shared_state.add_catalog_user(os.getpid(), active_collection_name)
+            product_collection = chroma_client.get_or_create_collection(
+                name=active_collection_name,
+                embedding_function=chroma_openai_ef
+            )
+            app.logger.info(f"ChromaDB collection '{active_collection_name}' loaded/created.")
+            component_status[step] = "ready"
 
-    model = ChatOpenAI(temperature=0, model_name=model_name)
-    prompt = PromptTemplate.from_template("""
-    You are a data bot that creates bundle-ready JSON.
-    Your goal is to help ecommerce managers create appealing bundles and price them effectively in euros (€) for a European context.
+            step = "indexes"
+            catalog_indexes_file_hash = ingest_state.get("file_hash")
+            if os.path.exists(COPURCHASE_INDEX_PATH):
+                copurchase_index = CoPurchaseIndex.load(COPURCHASE_INDEX_PATH)
+                app.logger.info(f"Loaded co-purchase index with {copurchase_index.num_pairs} SKU pairs from {COPURCHASE_INDEX_PATH}.")
+            if os.path.exists(LEXICAL_INDEX_PATH):
+                lexical_index = LexicalIndex.load(LEXICAL_INDEX_PATH)
+                app.logger.info(f"Loaded lexical index with {len(lexical_index.docs)} products from {LEXICAL_INDEX_PATH}.")
+            component_status[step] = "ready"
 
-    Based on the provided product data context (which includes 'Product Name' for each item, associated with a 'BaseSKU'), generate a product bundle.
-    The product data context is:
-    {context}
+            step = "llm"
+            valid_models = ["gpt-4", "gpt-4-turbo", "gpt-3.5-turbo"]
+            model_name = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
 
-    For the following user input, return a JSON object adhering to the specified schema.
-    Crucially:
-    1. The 'products' list in your JSON output MUST use the full, exact 'Product Name' values as found in the provided product data context for the BaseSKUs you select for the bundle. Do not abbreviate or alter these names.
-    2. The 'products' list, 'skus' list (which should contain BaseSKUs), and 'price_per_product' list MUST have the same number of elements, and their order must correspond (e.g., price_per_product[i] is the price for products[i] which has skus[i] as its BaseSKU).
-    3. If cost data for margin calculation is not available in the context, the 'margin' field in your JSON should be a string stating: 'Estimated due to lack of cost data'. Otherwise, provide a numeric margin.
-    4. For 'recommended_duration_notes', if specific start and end dates can be inferred from stock levels, seasonality, or user request, try to provide them in a structured way like 'Start:YYYY-MM-DD, End:YYYY-MM-DD' or 'Duration: X days/weeks from YYYY-MM-DD'. Otherwise, provide general notes.
-    5. Ensure all monetary values are in euros.
+            if model_name not in valid_models:
+                raise ValueError(f"Invalid model name: {model_name}. Must be one of {valid_models}")
 
-    User input: {user_input}
+            app.logger.info(f"Using OpenAI model: {model_name}")
 
-    JSON Schema to strictly follow:
-    {{
-    "bundle_name": "string (Descriptive name for the product bundle)",
-    "products": "List[string] (List of the full, exact product names as found in the provided context for the chosen BaseSKUs)",
-    "skus": "List[string] (List of BaseSKUs for each product, in the same order as 'products')",
-    "price_per_product": "List[float] (List of individual prices in euros (€) for each product, before discount, in order)",
-    "product_stock_levels": "List[string] (Notes on stock levels for each product, in order)",
-    "product_sales_metrics": "List[string] (Key sales metrics for each product, in order)",
-    "total_price": "float (Final discounted price of the bundle in euros (€))",
-    "original_total_price": "float (Total original price of items if bought separately in euros (€))",
-    "discount_percent": "float (Percentage discount for the bundle)",
-    "trend": "string (The trend of the bundle)",
-    "margin": "float OR string (The profit margin of the bundle. If numeric, it's a float. If estimated, it's a string like 'Estimated due to lack of cost data')",
-    "margin_type": "string (Indicates if margin is 'percentage' or 'absolute_eur', default 'percentage'. Only relevant if margin is numeric.)",
-    "summary": "string (Concise summary justifying the bundle, referencing data insights)",
-    "result": "string (Expected outcome or impact of this bundle)",
-    "recommended_duration_notes": "string (Optional: Notes on recommended availability period, considering stock levels. E.g., 'Offer for 2 weeks due to limited stock of Product Y', or 'Start: 2024-07-01, End: 2024-07-15')"
-    }}
-    """)
-    parser = JsonOutputParser(pydantic_object=BundleOutput)
-    chain = prompt | model | parser
-    app.logger.info("Langchain LLM and chain initialized.")
-
-except Exception as e:
-    app.logger.critical(f"CRITICAL FAILURE during core component initialization: {e}", exc_info=True)
+            model = ChatOpenAI(temperature=0, model_name=model_name)
+            prompt = PromptTemplate.from_template(BUNDLE_PROMPT_TEMPLATE)
+            parser = JsonOutputParser(pydantic_object=BundleOutput)
+            chain = prompt | model | parser
+            app.logger.info("Langchain LLM and chain initialized.")
+            component_status[step] = "ready"
+        except Exception as e:
+            app.logger.critical(f"CRITICAL FAILURE during core component initialization ({step}): {e}", exc_info=True)
+            for name, status in component_status.items():
+                if status == "pending":
+                    component_status[name] = f"error: {e}" if name == step else "skipped"
+        if components_ready():
+            components_pid = os.getpid()
+        else:
+            components_attempt.update(pid=os.getpid(), retry_at=time.monotonic() + COMPONENTS_INIT_RETRY_SECONDS)
+            app.logger.warning(f"Component initialization failed. Retrying on a request after {COMPONENTS_INIT_RETRY_SECONDS:.0f}s.")
+        app.logger.info(f"Component initialization for pid {os.getpid()} finished in {time.perf_counter() - started:.2f}s: {component_status}")
+        if components_ready() and app.config.get("INGEST_DEFAULT_DATA"):
+            start_default_data_ingestion()
+        return components_ready()
 
 def get_column_indices_from_headers(headers: List[str], required_column_map: Dict[str, str]) -> Dict[str, Optional[int]]:
     indices = {}
@@ -165,230 +1045,1511 @@ def get_column_indices_from_headers(headers: List[str], required_column_map: Dic
             app.logger.warning(f"Required column for '{internal_key}' (expected Excel header: '{excel_col_name}') not found.")
     return indices
 
-def process_and_ingest_excel_to_chroma(excel_file_path: str):
-    if not product_collection:
-        app.logger.error("ChromaDB product_collection is not available. Skipping ingestion.")
-        return
-    app.logger.info(f"Starting ingestion from Excel file: {excel_file_path}")
+def compute_file_hash(file_path: str, chunk_size: int = 1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def compute_product_content_hash(name: str, price: float, category: str, sales_note: str) -> str:
+    return hashlib.sha1(f"{PRODUCT_METADATA_VERSION}\x1f{name}\x1f{price:.2f}\x1f{category}\x1f{sales_note}".encode("utf-8")).hexdigest()
+
+def get_existing_content_hashes(collection=None) -> Dict[str, Optional[str]]:
+    """Returns {BaseSKU id: ContentHash} for everything in the collection (default: the active one), paged to bound memory."""
+    collection = collection if collection is not None else product_collection
+    existing: Dict[str, Optional[str]] = {}
+    offset = 0
+    while True:
+        page = collection.get(limit=EXCEL_PROCESSING_BATCH_SIZE, offset=offset, include=["metadatas"])
+        page_ids = page.get("ids") or []
+        if not page_ids:
+            break
+        for item_id, metadata in zip(page_ids, page.get("metadatas") or [None] * len(page_ids)):
+            existing[item_id] = (metadata or {}).get("ContentHash")
+        offset += len(page_ids)
+    return existing
+
+def _iter_xlsx_rows(file_path: str, sheet_name: str = DEFAULT_ORDERS_SHEET) -> Iterator[Sequence[Any]]:
+    # read_only + values_only streams rows straight from the sheet XML instead of building the cell model in RAM.
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
     try:
-        workbook = openpyxl.load_workbook(excel_file_path, data_only=True)
-        if DEFAULT_ORDERS_SHEET not in workbook.sheetnames:
-            app.logger.error(f"Sheet '{DEFAULT_ORDERS_SHEET}' not found in '{excel_file_path}'. No data ingested.")
+        if sheet_name not in workbook.sheetnames:
+            app.logger.error(f"Sheet '{sheet_name}' not found in '{file_path}'. No data ingested.")
             return
-        sheet = workbook[DEFAULT_ORDERS_SHEET]
-    except FileNotFoundError:
-        app.logger.error(f"Excel file not found at '{excel_file_path}'. No data ingested.")
-        return
-    except Exception as e:
-        app.logger.error(f"Error opening or reading Excel file '{excel_file_path}': {e}", exc_info=True)
-        return
+        yield from workbook[sheet_name].iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+def _iter_csv_rows(file_path: str) -> Iterator[Sequence[Any]]:
+    opener = gzip.open if file_path.lower().endswith(".gz") else open
+    with opener(file_path, mode="rt", newline="", encoding="utf-8-sig") as f:
+        yield from csv.reader(f)
 
-    header_cells = sheet[1]
-    headers = [str(cell.value).strip() if cell.value is not None else "" for cell in header_cells]
+def iter_order_rows(file_path: str, sheet_name: Optional[str] = None) -> Iterator[Sequence[Any]]:
+    """Yields the orders table row by row (header row first) from an .xlsx, .csv or .csv.gz export."""
+    lower_path = file_path.lower()
+    if lower_path.endswith((".csv", ".csv.gz")):
+        return _iter_csv_rows(file_path)
+    return _iter_xlsx_rows(file_path, sheet_name or DEFAULT_ORDERS_SHEET)
 
-    column_map = {
-        "order_number": ORDERS_ORDER_NUMBER_COLUMN, "complex_sku": ORDERS_SKU_COLUMN,
-        "item_title": ORDERS_ITEM_TITLE_COLUMN, "category": ORDERS_CATEGORY_COLUMN_FOR_CONTEXT,
-        "price": ORDERS_PRICE_COLUMN_FOR_CONTEXT, "quantity": ORDERS_QUANTITY_COLUMN,
+def list_order_sources(file_paths: List[str]) -> List[tuple]:
+    """(file_path, sheet_name) for every orders table: one per CSV, and the `orders` / `orders_*` sheets of a workbook."""
+    sources = []
+    for file_path in file_paths:
+        if file_path.lower().endswith((".csv", ".csv.gz")):
+            sources.append((file_path, None))
+            continue
+        workbook = openpyxl.load_workbook(file_path, read_only=True)
+        try:
+            sheet_names = [name for name in workbook.sheetnames
+                           if name == DEFAULT_ORDERS_SHEET or name.startswith(ORDERS_SHEET_SHARD_PREFIX)]
+        finally:
+            workbook.close()
+        if not sheet_names:
+            app.logger.error(f"Sheet '{DEFAULT_ORDERS_SHEET}' not found in '{file_path}'. No data ingested.")
+        sources.extend((file_path, sheet_name) for sheet_name in sheet_names)
+    return sources
+
+# --- Columnar per-SKU aggregation ---
+# An aggregate holds one entry per BaseSKU in first-seen order (name, price and category from its first row, summed
+# quantity) plus the distinct (SKU position, order code) pairs. Row chunks are folded into a running SkuAggregator and
+# sources aggregated in separate processes are merged with the same grouping, so sharding does not change the result.
+SKU_AGGREGATE_FIELDS = ("skus", "names", "prices", "categories", "quantities", "pair_skus", "pair_orders")
+ORDER_COLUMN_MAP = {
+    "order_number": ORDERS_ORDER_NUMBER_COLUMN, "complex_sku": ORDERS_SKU_COLUMN,
+    "item_title": ORDERS_ITEM_TITLE_COLUMN, "category": ORDERS_CATEGORY_COLUMN_FOR_CONTEXT,
+    "price": ORDERS_PRICE_COLUMN_FOR_CONTEXT, "quantity": ORDERS_QUANTITY_COLUMN,
+}
+
+def _str_column(values: Sequence[Any]) -> np.ndarray:
+    if None not in values:
+        return np.char.strip(np.asarray(values, dtype=str))
+    column = np.asarray(values, dtype=object)
+    column[np.equal(column, None)] = ""
+    return np.char.strip(column.astype(str))
+
+def _float_column(values: Sequence[Any]) -> np.ndarray:
+    """float() of every cell with None, unparsable and non-finite values as 0.0."""
+    column = np.asarray(values, dtype=object)
+    column[np.equal(column, None)] = 0.0
+    try:
+        floats = column.astype(np.float64)
+    except (ValueError, TypeError):
+        floats = np.empty(len(column), dtype=np.float64)
+        for i, value in enumerate(column.tolist()):
+            try: floats[i] = float(value)
+            except (ValueError, TypeError): floats[i] = 0.0
+    return np.where(np.isfinite(floats), floats, 0.0)
+
+def _group_sku_aggregate(skus: np.ndarray, quantities: np.ndarray, pair_skus: np.ndarray, pair_orders: np.ndarray, rows: int):
+    """Groups per-part SKU entries and de-duplicates their (SKU, order code) pairs. Returns the aggregate without its first-seen attributes, plus the
+    index of each SKU's first entry so the caller can fill in names, prices and categories."""
+    unique_skus, first_idx, inverse = np.unique(skus, return_index=True, return_inverse=True)
+    first_seen = np.argsort(first_idx, kind="stable")
+    position = np.empty_like(first_seen)
+    position[first_seen] = np.arange(len(first_seen))
+    inverse = position[inverse.reshape(-1)]
+    pair_skus = inverse[pair_skus]
+    order_values, order_idx = np.unique(pair_orders, return_inverse=True)
+    num_order_values = max(len(order_values), 1)
+    pair_codes = np.unique(pair_skus * num_order_values + order_idx.reshape(-1))
+    pair_skus, pair_orders = pair_codes // num_order_values, order_values[pair_codes % num_order_values]
+    aggregate = {
+        "rows": rows, "skus": unique_skus[first_seen],
+        "quantities": np.bincount(inverse, weights=quantities, minlength=len(first_seen)).round().astype(np.int64),
+        "pair_skus": pair_skus, "pair_orders": pair_orders,
     }
-    col_indices = get_column_indices_from_headers(headers, column_map)
+    return aggregate, first_idx[first_seen]
+
+def order_number_codes(order_numbers: np.ndarray) -> np.ndarray:
+    """64-bit FNV-1a hash of each order number's characters. The code only depends on the order number, so chunks and
+    sources hashed in different processes agree without sharing a lookup table; a collision between two orders is
+    about as likely as one in 10^8 for a million orders."""
+    codes = np.full(len(order_numbers), 0xCBF29CE484222325, dtype=np.uint64)
+    if order_numbers.dtype.itemsize:
+        characters = np.ascontiguousarray(order_numbers).view(np.uint32).reshape(len(order_numbers), -1).astype(np.uint64)
+        for column in characters.T:
+            # Padding NULs past the end of shorter strings are skipped, so the chunk's string width does not matter.
+            codes = np.where(column != 0, (codes ^ column) * np.uint64(0x100000001B3), codes)
+    return codes.view(np.int64)
+
+def _unique_pairs(pair_skus: np.ndarray, pair_orders: np.ndarray):
+    order = np.lexsort((pair_orders, pair_skus))
+    pair_skus, pair_orders = pair_skus[order], pair_orders[order]
+    keep = np.ones(len(pair_skus), dtype=bool)
+    keep[1:] = (pair_skus[1:] != pair_skus[:-1]) | (pair_orders[1:] != pair_orders[:-1])
+    return pair_skus[keep], pair_orders[keep]
+
+class SkuAggregator:
+    """Running per-SKU aggregate of order rows. Chunks are folded in as they are read and order numbers are reduced to
+    64-bit codes, so memory grows with the distinct SKUs and (SKU, order) pairs (16 bytes each) rather than with the
+    number of rows."""
+
+    def __init__(self):
+        self.rows = 0
+        self.sku_codes: Dict[str, int] = {}
+        self.names: List[str] = []
+        self.prices: List[float] = []
+        self.categories: List[str] = []
+        self.quantities = np.zeros(0, dtype=np.int64)
+        self.pair_skus = np.empty(0, dtype=np.int64)
+        self.pair_orders = np.empty(0, dtype=np.int64)
+        # De-duplicated chunk pairs wait here until they outnumber the merged pairs, keeping re-merges amortized.
+        self.pending_pairs: List[tuple] = []
+        self.pending_pair_count = 0
 
+    def add_rows(self, rows: List[Sequence[Any]], col_indices: Dict[str, Optional[int]]):
+        """Folds in a chunk of order rows, each long enough for every index in `col_indices`. Rows without a BaseSKU
+        are skipped; empty titles become 'Product <BaseSKU>', empty categories 'N/A', and unparsable
+        prices/quantities 0 (quantities truncate like int())."""
+        def column(internal_key: str, selected_rows: List[Sequence[Any]]) -> List[Any]:
+            idx = col_indices.get(internal_key)
+            return [None] * len(selected_rows) if idx is None else [row[idx] for row in selected_rows]
+
+        self.rows += len(rows)
+        base_skus = np.char.strip(np.char.partition(_str_column(column("complex_sku", rows)), "|")[:, 0])
+        kept_rows = np.flatnonzero(base_skus != "")
+        rows_by_position = [rows[i] for i in kept_rows.tolist()] if len(kept_rows) < len(rows) else rows
+        if not rows_by_position:
+            return
+        unique_skus, first_idx, inverse = np.unique(base_skus[kept_rows], return_index=True, return_inverse=True)
+        sku_codes = np.empty(len(unique_skus), dtype=np.int64)
+        new_sku_idx = []
+        for i in np.argsort(first_idx, kind="stable").tolist():
+            sku = str(unique_skus[i])
+            code = self.sku_codes.get(sku)
+            if code is None:
+                code = self.sku_codes[sku] = len(self.sku_codes)
+                new_sku_idx.append(i)
+            sku_codes[i] = code
+        if new_sku_idx:
+            # Name, price and category only come from each SKU's first row, so only those rows are converted.
+            first_rows = [rows_by_position[i] for i in first_idx[new_sku_idx].tolist()]
+            titles, categories = _str_column(column("item_title", first_rows)), _str_column(column("category", first_rows))
+            self.names.extend(np.where(titles != "", titles, np.char.add("Product ", unique_skus[new_sku_idx])).tolist())
+            self.prices.extend(_float_column(column("price", first_rows)).tolist())
+            self.categories.extend(np.where(categories != "", categories, "N/A").tolist())
+        row_skus = sku_codes[inverse.reshape(-1)]
+        quantities = np.trunc(_float_column(column("quantity", rows_by_position))).astype(np.int64)
+        self.quantities = np.concatenate((self.quantities, np.zeros(len(self.sku_codes) - len(self.quantities), dtype=np.int64)))
+        self.quantities += np.bincount(row_skus, weights=quantities, minlength=len(self.sku_codes)).round().astype(np.int64)
+
+        order_numbers = _str_column(column("order_number", rows_by_position))
+        has_order = order_numbers != ""
+        chunk_pairs = _unique_pairs(row_skus[has_order], order_number_codes(order_numbers[has_order]))
+        self.pending_pairs.append(chunk_pairs)
+        self.pending_pair_count += len(chunk_pairs[0])
+        if self.pending_pair_count > len(self.pair_skus):
+            self._merge_pending_pairs()
+
+    def _merge_pending_pairs(self):
+        if self.pending_pairs:
+            self.pair_skus, self.pair_orders = _unique_pairs(
+                np.concatenate([self.pair_skus] + [pair_skus for pair_skus, _ in self.pending_pairs]),
+                np.concatenate([self.pair_orders] + [pair_orders for _, pair_orders in self.pending_pairs]))
+            self.pending_pairs, self.pending_pair_count = [], 0
+
+    def result(self) -> Dict[str, Any]:
+        self._merge_pending_pairs()
+        return {
+            "rows": self.rows, "skus": np.asarray(list(self.sku_codes), dtype=str), "names": np.asarray(self.names, dtype=str),
+            "prices": np.asarray(self.prices, dtype=np.float64), "categories": np.asarray(self.categories, dtype=str),
+            "quantities": self.quantities, "pair_skus": self.pair_skus, "pair_orders": self.pair_orders,
+        }
+
+def merge_sku_aggregates(parts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Merges aggregates in order: first-seen attributes come from the earliest part, quantities add up and the
+    (SKU, order) pairs are de-duplicated, so an order split across parts is still counted once per SKU."""
+    if not parts:
+        return SkuAggregator().result()
+    offsets = np.cumsum([0] + [len(part["skus"]) for part in parts[:-1]])
+    aggregate, first_idx = _group_sku_aggregate(
+        np.concatenate([part["skus"] for part in parts]), np.concatenate([part["quantities"] for part in parts]),
+        np.concatenate([part["pair_skus"] + offset for part, offset in zip(parts, offsets)]),
+        np.concatenate([part["pair_orders"] for part in parts]), sum(part["rows"] for part in parts),
+    )
+    for field in ("names", "prices", "categories"):
+        aggregate[field] = np.concatenate([part[field] for part in parts])[first_idx]
+    return aggregate
+
+def fold_order_source(aggregator: SkuAggregator, file_path: str, sheet_name: Optional[str] = None,
+                      progress: Optional[Dict[str, Any]] = None):
+    """Reads one orders table in chunks of INGEST_AGGREGATION_CHUNK_ROWS rows into `aggregator`."""
+    source_name = f"{file_path}[{sheet_name}]" if sheet_name else file_path
+    rows = iter_order_rows(file_path, sheet_name)
+    header_row = next(rows, None)
+    if header_row is None:
+        raise ValueError(f"No header row found in '{source_name}'.")
+    headers = [str(value).strip() if value is not None else "" for value in header_row]
+    col_indices = get_column_indices_from_headers(headers, ORDER_COLUMN_MAP)
     if any(col_indices.get(key) is None for key in ["complex_sku", "item_title", "price"]):
-        app.logger.error("Essential columns (SKU, Item title, Price) are missing from orders sheet. Aborting ingestion.")
+        raise ValueError(f"Essential columns (SKU, Item title, Price) are missing from '{source_name}'.")
+
+    # Rows are cut down to the six used columns as they stream in. Holding whole row lists for a chunk makes the
+    # garbage collector rescan them on every full pass, which costs more than the aggregation itself.
+    used_keys = [key for key in ORDER_COLUMN_MAP if col_indices.get(key) is not None]
+    used_columns = operator.itemgetter(*(col_indices[key] for key in used_keys))
+    row_width = max(col_indices[key] for key in used_keys) + 1
+    def project(row: Sequence[Any]) -> tuple:
+        try:
+            return used_columns(row)
+        except IndexError:  # Short CSV row: the missing trailing cells count as empty.
+            return used_columns(list(row) + [None] * (row_width - len(row)))
+    projected_indices = {key: used_keys.index(key) if key in used_keys else None for key in ORDER_COLUMN_MAP}
+
+    rows_read = 0
+    started_at = time.perf_counter()
+    while True:
+        chunk = list(map(project, itertools.islice(rows, INGEST_AGGREGATION_CHUNK_ROWS)))
+        if not chunk:
+            break
+        aggregator.add_rows(chunk, projected_indices)
+        rows_read += len(chunk)
+        if progress is not None:
+            progress["rows_processed"] = progress.get("rows_processed", 0) + len(chunk)
+        elapsed = time.perf_counter() - started_at
+        app.logger.info(f"Read {rows_read} rows from '{source_name}' ({rows_read / elapsed if elapsed > 0 else 0:.0f} rows/sec).")
+
+def aggregate_order_source(file_path: str, sheet_name: Optional[str] = None, progress: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+    """Aggregate of one orders table. Module-level so it can run in an ingestion worker process; `progress` is only
+    updated in-process."""
+    aggregator = SkuAggregator()
+    fold_order_source(aggregator, file_path, sheet_name, progress)
+    return aggregator.result()
+
+def aggregate_order_sources(sources: List[tuple], progress: Dict[str, Any]) -> Dict[str, Any]:
+    """Aggregates every (file, sheet) source: folded into one running aggregate in-process, or in a process pool when
+    there is more than one source and worker, with the per-source results merged in source order."""
+    workers = min(INGEST_PARSE_WORKERS, len(sources))
+    if workers <= 1:
+        aggregator = SkuAggregator()
+        for file_path, sheet_name in sources:
+            fold_order_source(aggregator, file_path, sheet_name, progress)
+        return aggregator.result()
+    app.logger.info(f"Aggregating {len(sources)} order tables with {workers} worker processes.")
+    parts = []
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(INGEST_PARSE_START_METHOD)) as pool:
+        futures = [pool.submit(aggregate_order_source, file_path, sheet_name) for file_path, sheet_name in sources]
+        for future in futures:
+            parts.append(future.result())
+            progress["rows_processed"] = progress.get("rows_processed", 0) + parts[-1]["rows"]
+    return merge_sku_aggregates(parts)
+
+def save_catalog_snapshot(path: str, aggregate: Dict[str, Any], source_hash: str):
+    # Stored uncompressed: deflating a million order numbers takes longer than loading the raw arrays back.
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, source_hash=np.str_(source_hash), aggregation_version=np.str_(CATALOG_AGGREGATION_VERSION),
+             rows=np.int64(aggregate["rows"]), **{field: aggregate[field] for field in SKU_AGGREGATE_FIELDS})
+    os.replace(tmp_path, path)
+
+def load_catalog_snapshot(path: str, source_hash: str) -> Optional[Dict[str, Any]]:
+    """The aggregate saved for `source_hash`, or None if there is no matching snapshot."""
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            if str(data["source_hash"]) != source_hash or str(data["aggregation_version"]) != CATALOG_AGGREGATION_VERSION:
+                return None
+            return dict({field: data[field] for field in SKU_AGGREGATE_FIELDS}, rows=int(data["rows"]))
+    except Exception as e:
+        app.logger.warning(f"Could not load catalog snapshot from '{path}': {e}")
+        return None
+
+# --- Catalog generations (blue/green collections) ---
+catalog_lock = threading.Lock()
+catalog_readers: Dict[str, int] = {}
+retired_collection_names: List[str] = []
+catalog_refresh_lock = threading.Lock()
+catalog_state_mtime: Optional[float] = None
+catalog_indexes_file_hash: Optional[str] = None  # Order file the loaded co-purchase/lexical indexes were built from.
+
+def catalog_generation_of(collection_name: str) -> int:
+    _, separator, suffix = collection_name.rpartition(CATALOG_GENERATION_SEPARATOR)
+    return int(suffix) if separator and suffix.isdigit() else 0
+
+def latest_catalog_generation() -> int:
+    """Highest generation number in Chroma, so reserved names stay unique even if the shared state file was reset."""
+    names = [collection if isinstance(collection, str) else collection.name for collection in chroma_client.list_collections()]
+    return max([catalog_generation_of(name) for name in names if name.startswith(CHROMA_COLLECTION_NAME)] + [0])
+
+def refresh_active_collection():
+    """Adopts a generation that another worker process activated, and its co-purchase/lexical indexes (which change
+    with the orders even when no product does). The ingest state file names both, so it is only re-read when its
+    mtime changes."""
+    global catalog_state_mtime, catalog_indexes_file_hash, copurchase_index, lexical_index
+    try:
+        state_mtime = os.stat(INGEST_STATE_FILE).st_mtime
+    except OSError:
         return
+    if state_mtime == catalog_state_mtime or chroma_client is None:
+        return
+    with catalog_refresh_lock:
+        if state_mtime == catalog_state_mtime:
+            return
+        catalog_state_mtime = state_mtime
+        ingest_state = load_ingest_state()
+        if ingest_state.get("file_hash") != catalog_indexes_file_hash:
+            # The index files are written before the state file, so they already belong to the state's order file.
+            catalog_indexes_file_hash = ingest_state.get("file_hash")
+            if os.path.exists(COPURCHASE_INDEX_PATH):
+                copurchase_index = CoPurchaseIndex.load(COPURCHASE_INDEX_PATH)
+            if os.path.exists(LEXICAL_INDEX_PATH):
+                lexical_index = LexicalIndex.load(LEXICAL_INDEX_PATH)
+            bundle_response_cache.clear()
+        collection_name = ingest_state.get("active_collection")
+        if not collection_name or collection_name == active_collection_name:
+            return
+        try:
+            collection = chroma_client.get_collection(name=collection_name, embedding_function=chroma_openai_ef)
+        except Exception as e:
+            app.logger.warning(f"Could not open catalog generation '{collection_name}' activated by another worker: {e}")
+            return
+        app.logger.info(f"Catalog generation '{collection_name}' was activated by another worker. Adopting it.")
+        activate_catalog_generation(collection_name, collection)
 
-    processed_data_by_base_sku: Dict[str, Dict[str, Any]] = {}
-    for row_idx, row_cells in enumerate(sheet.iter_rows(min_row=2), start=2):
-        row_values = [cell.value for cell in row_cells]
-        def get_val(internal_key: str):
-            idx = col_indices.get(internal_key)
-            return row_values[idx] if idx is not None and idx < len(row_values) else None
-
-        complex_sku_raw = get_val("complex_sku")
-        complex_sku = str(complex_sku_raw).strip() if complex_sku_raw is not None else ""
-        if not complex_sku: continue
-        base_sku = complex_sku.split('|', 1)[0].strip()
-        if not base_sku: continue
-
-        item_title_raw = get_val("item_title")
-        item_title = str(item_title_raw).strip() if item_title_raw and str(item_title_raw).strip() else f"Product {base_sku}"
-        price_raw = get_val("price")
-        try: price = float(price_raw) if price_raw is not None else 0.0
-        except (ValueError, TypeError): price = 0.0; app.logger.debug(f"R{row_idx} (BSKU:{base_sku}): Price err '{price_raw}'->0.0")
-        category_raw = get_val("category")
-        category = str(category_raw).strip() if category_raw and str(category_raw).strip() else "N/A"
-        quantity_raw = get_val("quantity")
-        try: quantity = int(float(str(quantity_raw))) if quantity_raw is not None else 0
-        except (ValueError, TypeError): quantity = 0; app.logger.debug(f"R{row_idx} (BSKU:{base_sku}): Qty err '{quantity_raw}'->0")
-        order_number_raw = get_val("order_number")
-        order_number = str(order_number_raw).strip() if order_number_raw else None
-
-        if base_sku not in processed_data_by_base_sku:
-            processed_data_by_base_sku[base_sku] = {
-                "name": item_title, "price": price, "category": category,
-                "total_quantity_sold": 0, "order_numbers": set(), "complex_sku_examples": set()
-            }
-        processed_data_by_base_sku[base_sku]["total_quantity_sold"] += quantity
-        if order_number: processed_data_by_base_sku[base_sku]["order_numbers"].add(order_number)
-        if complex_sku: processed_data_by_base_sku[base_sku]["complex_sku_examples"].add(complex_sku)
+def pin_active_collection():
+    """Resolves the active catalog generation and keeps it from being dropped until unpin_collection() is called."""
+    refresh_active_collection()
+    with catalog_lock:
+        collection_name, collection = active_collection_name, product_collection
+        catalog_readers[collection_name] = catalog_readers.get(collection_name, 0) + 1
+    return collection_name, collection
+
+def unpin_collection(collection_name: str):
+    with catalog_lock:
+        catalog_readers[collection_name] -= 1
+    collect_retired_collections()
+
+def activate_catalog_generation(collection_name: str, collection):
+    global product_collection, active_collection_name
+    if shared_state is not None:
+        shared_state.add_catalog_user(os.getpid(), collection_name)
+    with catalog_lock:
+        previous_name = active_collection_name
+        product_collection, active_collection_name = collection, collection_name
+        if previous_name != collection_name:
+            retired_collection_names.append(previous_name)
+    bundle_response_cache.clear()
+    app.logger.info(f"Active catalog switched from '{previous_name}' to '{collection_name}'. Bundle response cache cleared.")
+    collect_retired_collections()
+
+def collect_retired_collections():
+    """Drops retired generations this process no longer reads, unless another live worker process still uses them;
+    the last process to let go of a generation drops it. The standby generation is kept for the next refresh."""
+    with catalog_lock:
+        drained = [name for name in retired_collection_names if catalog_readers.get(name, 0) == 0]
+        for name in drained:
+            retired_collection_names.remove(name)
+            catalog_readers.pop(name, None)
+    standby_name = load_ingest_state().get("standby_collection") if drained else None
+    for name in drained:
+        if name == standby_name:
+            if shared_state is not None:
+                shared_state.release_catalog(os.getpid(), name)
+            app.logger.info(f"Keeping retired catalog collection '{name}' as the standby for the next refresh.")
+            continue
+        if shared_state is not None and not shared_state.release_catalog(os.getpid(), name):
+            app.logger.info(f"Retired catalog collection '{name}' is still used by another worker. It will be dropped by the last one.")
+            continue
+        try:
+            chroma_client.delete_collection(name)
+            app.logger.info(f"Dropped retired catalog collection '{name}'.")
+        except Exception as e:
+            app.logger.warning(f"Could not drop retired catalog collection '{name}': {e}")
+
+def drop_orphaned_catalog_generations():
+    """Removes generations left behind by a crash or an interrupted build. Generations being built or read by a live
+    worker are registered in the shared state and survive the sweep."""
+    refresh_active_collection()
+    standby_name = load_ingest_state().get("standby_collection")
+    for collection in chroma_client.list_collections():
+        name = collection if isinstance(collection, str) else collection.name
+        if name in (active_collection_name, standby_name):
+            continue
+        if name == CHROMA_COLLECTION_NAME or name.startswith(CHROMA_COLLECTION_NAME + CATALOG_GENERATION_SEPARATOR):
+            with catalog_lock:
+                retired_collection_names.append(name)
+    collect_retired_collections()
+
+def activate_copurchase_index(index: CoPurchaseIndex):
+    global copurchase_index
+    index.save(COPURCHASE_INDEX_PATH)
+    copurchase_index = index
+    # Co-purchase partners feed the LLM context, so responses built from the old index are stale.
+    bundle_response_cache.clear()
+
+def activate_lexical_index(index: LexicalIndex):
+    global lexical_index
+    index.save(LEXICAL_INDEX_PATH)
+    lexical_index = index
+    bundle_response_cache.clear()
+
+def build_catalog_generation(collection_name: str, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]],
+                             changed_indices: List[int], progress: Dict[str, Any]):
+    """Creates a new collection holding the full catalog: unchanged products are copied with their stored
+    embeddings from the active collection, only new/changed products are embedded. The collection is dropped again
+    if the build fails."""
+    new_collection = chroma_client.create_collection(name=collection_name, embedding_function=chroma_openai_ef)
+    try:
+        changed_index_set = set(changed_indices)
+        unchanged_ids = [item_id for i, item_id in enumerate(ids) if i not in changed_index_set]
+
+        progress.update(stage="copying_unchanged")
+        copy_started_at = time.perf_counter()
+        for start_idx in range(0, len(unchanged_ids), EXCEL_PROCESSING_BATCH_SIZE):
+            existing = product_collection.get(ids=unchanged_ids[start_idx:start_idx + EXCEL_PROCESSING_BATCH_SIZE],
+                                              include=["embeddings", "documents", "metadatas"])
+            new_collection.add(ids=existing["ids"], embeddings=existing["embeddings"],
+                               documents=existing["documents"], metadatas=existing["metadatas"])
+        metrics.observe("ingest_stage_duration_seconds", time.perf_counter() - copy_started_at, stage="copy_unchanged")
+        if unchanged_ids:
+            app.logger.info(f"Copied {len(unchanged_ids)} unchanged products into '{collection_name}' in {time.perf_counter() - copy_started_at:.2f}s without re-embedding.")
+
+        num_batches = (len(changed_indices) + EXCEL_PROCESSING_BATCH_SIZE - 1) // EXCEL_PROCESSING_BATCH_SIZE
+        progress.update(stage="embedding", batches_total=num_batches, batches_embedded=0, embedding_started_at=time.time())
+        embedding_started_at = time.perf_counter()
+        for i in range(num_batches):
+            batch_indices = changed_indices[i * EXCEL_PROCESSING_BATCH_SIZE:(i + 1) * EXCEL_PROCESSING_BATCH_SIZE]
 
+            app.logger.info(f"Ingesting batch {i+1}/{num_batches} ({len(batch_indices)} items) into '{collection_name}'.")
+            batch_started_at = time.perf_counter()
+            new_collection.add(
+                documents=[documents[k] for k in batch_indices],
+                metadatas=[metadatas[k] for k in batch_indices],
+                ids=[ids[k] for k in batch_indices]
+            )
+            batch_elapsed = time.perf_counter() - batch_started_at
+            app.logger.info(f"Batch {i+1}/{num_batches} ingestion successful in {batch_elapsed:.2f}s ({len(batch_indices) / batch_elapsed if batch_elapsed > 0 else 0:.0f} items/sec).")
+            progress["batches_embedded"] = i + 1
+        metrics.observe("ingest_stage_duration_seconds", time.perf_counter() - embedding_started_at, stage="embed")
+
+        progress.update(stage="validating")
+        new_count = new_collection.count()
+        if new_count != len(ids):
+            raise ValueError(f"Catalog generation '{collection_name}' has {new_count} items, expected {len(ids)}.")
+    except Exception:
+        # Only the collection this call created is dropped; a name clash must never delete another worker's catalog.
+        try: chroma_client.delete_collection(collection_name)
+        except Exception: pass
+        raise
+    return new_collection
+
+def claim_standby_catalog_generation() -> Optional[tuple]:
+    """The standby generation (the one active before the last refresh) as (name, collection), if it can be refreshed
+    in place: no request in this process and no other worker process still reads it. Nobody pins a standby, so once
+    drained it stays unread until it is activated again."""
+    standby_name = load_ingest_state().get("standby_collection")
+    if not standby_name or standby_name == active_collection_name or shared_state is None:
+        return None
+    with catalog_lock:
+        if catalog_readers.get(standby_name, 0) or standby_name in retired_collection_names:
+            return None
+    if shared_state.has_other_users(os.getpid(), standby_name):
+        return None
+    try:
+        collection = chroma_client.get_collection(name=standby_name, embedding_function=chroma_openai_ef)
+    except Exception as e:
+        app.logger.warning(f"Standby catalog generation '{standby_name}' is unavailable ({e}). Building a new generation.")
+        return None
+    shared_state.add_catalog_user(os.getpid(), standby_name)  # Keeps startup sweeps away while it is refreshed.
+    return standby_name, collection
+
+def refresh_catalog_generation_in_place(collection_name: str, collection, ids: List[str], documents: List[str],
+                                        metadatas: List[Dict[str, Any]], progress: Dict[str, Any]):
+    """Brings the standby generation up to the full catalog by upserting the products that differ from what it holds
+    and deleting the ones that are gone. Texts that the active generation already embedded come from the embedding
+    cache, so only genuinely new content is embedded. If this fails the standby is left partly updated; the next
+    refresh diffs against its actual content, so it converges."""
+    standby_hashes = get_existing_content_hashes(collection)
+    changed_indices = [i for i, (item_id, metadata) in enumerate(zip(ids, metadatas)) if standby_hashes.get(item_id) != metadata["ContentHash"]]
+    new_id_set = set(ids)
+    stale_ids = [item_id for item_id in standby_hashes if item_id not in new_id_set]
+    app.logger.info(f"Refreshing standby generation '{collection_name}' in place: {len(changed_indices)} upserts, {len(stale_ids)} deletions.")
+
+    num_batches = (len(changed_indices) + EXCEL_PROCESSING_BATCH_SIZE - 1) // EXCEL_PROCESSING_BATCH_SIZE
+    progress.update(stage="embedding", batches_total=num_batches, batches_embedded=0, embedding_started_at=time.time())
+    embedding_started_at = time.perf_counter()
+    for i in range(num_batches):
+        batch_indices = changed_indices[i * EXCEL_PROCESSING_BATCH_SIZE:(i + 1) * EXCEL_PROCESSING_BATCH_SIZE]
+        collection.upsert(documents=[documents[k] for k in batch_indices], metadatas=[metadatas[k] for k in batch_indices],
+                          ids=[ids[k] for k in batch_indices])
+        progress["batches_embedded"] = i + 1
+    for start_idx in range(0, len(stale_ids), EXCEL_PROCESSING_BATCH_SIZE):
+        collection.delete(ids=stale_ids[start_idx:start_idx + EXCEL_PROCESSING_BATCH_SIZE])
+    metrics.observe("ingest_stage_duration_seconds", time.perf_counter() - embedding_started_at, stage="embed")
+
+    progress.update(stage="validating")
+    new_count = collection.count()
+    if new_count != len(ids):
+        raise ValueError(f"Catalog generation '{collection_name}' has {new_count} items, expected {len(ids)}.")
+
+def process_and_ingest_excel_to_chroma(excel_file_path: Union[str, List[str]], progress: Optional[Dict[str, Any]] = None) -> bool:
+    """Ingests one or more order exports into ChromaDB. Returns False on failure; `progress`, if given, is updated in place."""
+    global catalog_indexes_file_hash
+    progress = progress if progress is not None else {}
+    # Diff against the generation another worker may have activated since this process last looked.
+    refresh_active_collection()
+    if not product_collection:
+        app.logger.error("ChromaDB product_collection is not available. Skipping ingestion.")
+        return False
+    file_paths = [excel_file_path] if isinstance(excel_file_path, str) else list(excel_file_path)
+    app.logger.info(f"Starting ingestion from order file(s): {', '.join(file_paths)}")
+    progress.update(stage="reading", rows_processed=0)
+    try:
+        file_stat = os.stat(file_paths[0]) if len(file_paths) == 1 else None
+        file_hashes = [compute_file_hash(file_path) for file_path in file_paths]
+        file_hash = file_hashes[0] if len(file_hashes) == 1 else hashlib.sha256("\n".join(file_hashes).encode("utf-8")).hexdigest()
+        ingest_state = load_ingest_state()
+        if (ingest_state.get("file_hash") == file_hash and ingest_state.get("metadata_version") == PRODUCT_METADATA_VERSION
+                and product_collection.count() > 0):
+            app.logger.info(f"'{excel_file_path}' matches the last ingested file (sha256 {file_hash[:12]}). Ingestion skipped.")
+            if file_stat is not None:
+                save_ingest_state(dict(ingest_state, file_size=file_stat.st_size, file_mtime=file_stat.st_mtime))
+            progress.update(stage="skipped_unchanged")
+            return True
+        rows_started_at = time.perf_counter()
+        aggregate = load_catalog_snapshot(CATALOG_SNAPSHOT_PATH, file_hash)
+        from_snapshot = aggregate is not None
+        if from_snapshot:
+            app.logger.info(f"Loaded the aggregated catalog ({len(aggregate['skus'])} BaseSKUs) from '{CATALOG_SNAPSHOT_PATH}' instead of re-reading the export.")
+            progress["rows_processed"] = aggregate["rows"]
+        else:
+            sources = list_order_sources(file_paths)
+            if not sources:
+                return False
+            aggregate = aggregate_order_sources(sources, progress)
+            save_catalog_snapshot(CATALOG_SNAPSHOT_PATH, aggregate, file_hash)
+    except FileNotFoundError as e:
+        app.logger.error(f"Order file not found: {e}. No data ingested.")
+        return False
+    except Exception as e:
+        app.logger.error(f"Error opening or reading order file(s) '{excel_file_path}': {e}", exc_info=True)
+        return False
+
+    rows_read = aggregate["rows"]
+    rows_elapsed = time.perf_counter() - rows_started_at
+    progress.update(rows_processed=rows_read, products_found=len(aggregate["skus"]))
+    metrics.observe("ingest_stage_duration_seconds", rows_elapsed, stage="read")
+    if rows_elapsed > 0 and not from_snapshot:
+        metrics.observe("ingest_rows_per_second", rows_read / rows_elapsed, buckets=THROUGHPUT_BUCKETS)
+
+    skus, names = aggregate["skus"].tolist(), aggregate["names"].tolist()
+    progress.update(stage="copurchase_index")
+    index_started_at = time.perf_counter()
+    new_copurchase_index = CoPurchaseIndex.build(skus, names, aggregate["pair_orders"], aggregate["pair_skus"])
+    index_elapsed = time.perf_counter() - index_started_at
+    metrics.observe("ingest_stage_duration_seconds", index_elapsed, stage="copurchase_index")
+    app.logger.info(f"Built co-purchase index over {new_copurchase_index.num_orders} orders: {new_copurchase_index.num_pairs} SKU pairs in {index_elapsed:.2f}s.")
+    app.logger.info(f"Finished reading {rows_read} rows in {rows_elapsed:.1f}s ({rows_read / rows_elapsed if rows_elapsed > 0 else 0:.0f} rows/sec): {len(skus)} BaseSKUs.")
+
+    order_counts = np.bincount(aggregate["pair_skus"], minlength=len(skus)).tolist()
     docs_to_add, metadatas_to_add, ids_to_add = [], [], []
-    for base_sku, data in processed_data_by_base_sku.items():
-        num_orders = len(data["order_numbers"])
-        total_sold = data["total_quantity_sold"]
+    for base_sku, name, price, category, total_sold, num_orders in zip(
+            skus, names, aggregate["prices"].tolist(), aggregate["categories"].tolist(), aggregate["quantities"].tolist(), order_counts):
         sales_note = f"Sales: {total_sold} units in {num_orders} orders."
         if total_sold > 100: sales_note += " (Popular)"
         elif 0 < total_sold < 10: sales_note += " (Slow Mover)"
         elif total_sold == 0: sales_note += " (No sales in this data)"
-        doc_content = (f"Product: {data['name']}; BSKU: {base_sku}; Price:€{data['price']:.2f}; Cat:{data['category']}; {sales_note}")
+        doc_content = (f"Product: {name}; BSKU: {base_sku}; Price:€{price:.2f}; Cat:{category}; {sales_note}")
         docs_to_add.append(doc_content)
         metadatas_to_add.append({
-            "BaseSKU": base_sku, "ProductName": data["name"], "Price": data["price"],
-            "Category": data["category"], "SalesMetrics": sales_note,
-            "StockInfo": "Stock data N/A (placeholder)"
+            "BaseSKU": base_sku, "ProductName": name, "Price": price,
+            "Category": category, "SalesMetrics": sales_note,
+            "StockInfo": "Stock data N/A (placeholder)",
+            "TotalSold": total_sold, "OrderCount": num_orders,
+            "ContentHash": compute_product_content_hash(name, price, category, sales_note),
         })
         ids_to_add.append(base_sku)
 
     if docs_to_add:
         try:
-            current_item_count = product_collection.count()
-            if current_item_count > 0:
-                app.logger.info(f"Attempting to clear {current_item_count} items from '{CHROMA_COLLECTION_NAME}'.")
-                all_ids_in_collection = product_collection.get(limit=current_item_count, include=[])['ids']
-                if all_ids_in_collection:
-                    product_collection.delete(ids=all_ids_in_collection)
-                    app.logger.info(f"Cleared {len(all_ids_in_collection)} items from collection.")
-            
-            app.logger.info(f"Prepared {len(docs_to_add)} total products for ingestion in batches.")
-            
-            num_batches = (len(docs_to_add) + EXCEL_PROCESSING_BATCH_SIZE - 1) // EXCEL_PROCESSING_BATCH_SIZE
-            for i in range(num_batches):
-                start_idx = i * EXCEL_PROCESSING_BATCH_SIZE
-                end_idx = min((i + 1) * EXCEL_PROCESSING_BATCH_SIZE, len(docs_to_add))
-                
-                batch_docs = docs_to_add[start_idx:end_idx]
-                batch_metadatas = metadatas_to_add[start_idx:end_idx]
-                batch_ids = ids_to_add[start_idx:end_idx]
-                
-                app.logger.info(f"Ingesting batch {i+1}/{num_batches} ({len(batch_docs)} items) into ChromaDB.")
-                product_collection.add(
-                    documents=batch_docs,
-                    metadatas=batch_metadatas,
-                    ids=batch_ids
-                )
-                app.logger.info(f"Batch {i+1}/{num_batches} ingestion successful.")
-            
-            app.logger.info("All batches ingested into ChromaDB successfully.")
+            diff_started_at = time.perf_counter()
+            existing_hashes = get_existing_content_hashes()
+            changed_indices = [
+                i for i, (item_id, metadata) in enumerate(zip(ids_to_add, metadatas_to_add))
+                if existing_hashes.get(item_id) != metadata["ContentHash"]
+            ]
+            new_id_set = set(ids_to_add)
+            ids_to_delete = [item_id for item_id in existing_hashes if item_id not in new_id_set]
+            app.logger.info(
+                f"Differential ingestion: {len(ids_to_add)} products in file, {len(existing_hashes)} in collection; "
+                f"{len(changed_indices)} new/changed, {len(ids_to_delete)} removed, {len(ids_to_add) - len(changed_indices)} unchanged."
+            )
+            metrics.observe("ingest_stage_duration_seconds", time.perf_counter() - diff_started_at, stage="diff")
+
+            new_collection_name = active_collection_name
+            standby_collection_name = ingest_state.get("standby_collection")
+            replaced_standby_name = None
+            if changed_indices or ids_to_delete:
+                # Readers keep the active generation until the switch. The standby (the generation before it) only
+                # needs the changes since it was active; a brand-new generation has to copy every unchanged product.
+                standby = claim_standby_catalog_generation()
+                if standby is not None:
+                    new_collection_name, new_collection = standby
+                    try:
+                        refresh_catalog_generation_in_place(new_collection_name, new_collection, ids_to_add, docs_to_add, metadatas_to_add, progress)
+                    except Exception:
+                        shared_state.release_catalog(os.getpid(), new_collection_name)
+                        raise
+                else:
+                    new_collection_name = shared_state.reserve_catalog_generation(
+                        os.getpid(), CHROMA_COLLECTION_NAME + CATALOG_GENERATION_SEPARATOR, latest_catalog_generation())
+                    try:
+                        new_collection = build_catalog_generation(new_collection_name, ids_to_add, docs_to_add, metadatas_to_add, changed_indices, progress)
+                    except Exception:
+                        shared_state.release_catalog(os.getpid(), new_collection_name)
+                        raise
+                    if standby_collection_name and standby_collection_name != active_collection_name:
+                        replaced_standby_name = standby_collection_name
+                standby_collection_name = active_collection_name
+            else:
+                app.logger.info("Catalog content unchanged. Keeping the active collection.")
+
+            activate_started_at = time.perf_counter()
+            activate_copurchase_index(new_copurchase_index)
+            activate_lexical_index(LexicalIndex.from_metadatas(metadatas_to_add))
+            catalog_indexes_file_hash = file_hash
+            set_catalog_sku_index(new_collection_name, metadatas_to_add)
+            # Other worker processes adopt the generation named in the state file, so it is written after the indexes.
+            save_ingest_state({"file_hash": file_hash, "source_path": excel_file_path, "product_count": len(ids_to_add),
+                               "active_collection": new_collection_name, "standby_collection": standby_collection_name,
+                               "metadata_version": PRODUCT_METADATA_VERSION,
+                               "file_size": file_stat.st_size if file_stat else None,
+                               "file_mtime": file_stat.st_mtime if file_stat else None})
+            if replaced_standby_name:
+                # The standby that was still busy is replaced by the current active generation; retire it.
+                with catalog_lock:
+                    retired_collection_names.append(replaced_standby_name)
+            if new_collection_name != active_collection_name:
+                activate_catalog_generation(new_collection_name, new_collection)
+            metrics.observe("ingest_stage_duration_seconds", time.perf_counter() - activate_started_at, stage="activate")
+            app.logger.info("Differential ingestion into ChromaDB completed successfully.")
+            if embedding_cache is not None:
+                app.logger.info(f"Embedding cache stats: {embedding_cache.stats()}")
         except Exception as e_chroma:
-            app.logger.error(f"Error during ChromaDB add/delete operation: {e_chroma}", exc_info=True)
+            app.logger.error(f"Error while building the new catalog generation: {e_chroma}", exc_info=True)
+            return False
     else:
         app.logger.info("No valid product data found in Excel to ingest into ChromaDB.")
+    return True
+
+ingestion_lock = threading.Lock()
 
-def ensure_data_is_ingested(file_path=DEFAULT_DATA_FILE_PATH, force_reingest=False):
+@contextmanager
+def catalog_ingestion_lock():
+    """Runs ingestions one at a time: the thread lock covers this process, a lock file every worker process."""
+    with ingestion_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(INGEST_LOCK_PATH, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def ensure_data_is_ingested(file_path=DEFAULT_DATA_FILE_PATH, force_reingest=False, progress: Optional[Dict[str, Any]] = None) -> bool:
     if product_collection is None:
         app.logger.error("Cannot ensure data ingestion: ChromaDB collection not available.")
+        return False
+    # Requests only need a non-empty catalog; while a background job holds the lock they are answered from the
+    # last complete generation instead of waiting for the job.
+    if not force_reingest and product_collection.count() > 0:
+        return True
+    # Ingestions diff against and replace the same active generation, so run them one at a time across all workers.
+    with catalog_ingestion_lock():
+        collection_is_empty = product_collection.count() == 0
+        if force_reingest or collection_is_empty:
+            action = "Re-ingesting" if force_reingest and not collection_is_empty else "Ingesting"
+            app.logger.info(f"ChromaDB: {action} data from '{file_path}' (Force:{force_reingest}, Empty:{collection_is_empty}).")
+            progress = progress if progress is not None else {}
+            started_at = time.perf_counter()
+            succeeded = process_and_ingest_excel_to_chroma(file_path, progress=progress)
+            elapsed = time.perf_counter() - started_at
+            result = "skipped" if progress.get("stage") == "skipped_unchanged" else "completed" if succeeded else "failed"
+            metrics.observe("ingest_stage_duration_seconds", elapsed, stage="total")
+            metrics.inc("ingestions_total", result=result)
+            app.logger.info(f"Ingestion of '{file_path}' {result} in {elapsed:.2f}s.")
+            return succeeded
+        app.logger.info(f"ChromaDB '{CHROMA_COLLECTION_NAME}' has {product_collection.count()} items. Default ingestion skipped.")
+        return True
+
+def ingested_file_is_current(file_path: str) -> bool:
+    """True when the persisted catalog was built from this file. Size and mtime are checked first so an unchanged
+    file is not re-hashed on every boot; the sha256 is only computed when the mtime moved."""
+    ingest_state = load_ingest_state()
+    if (ingest_state.get("metadata_version") != PRODUCT_METADATA_VERSION or product_collection is None
+            or product_collection.count() == 0):
+        return False
+    file_stat = os.stat(file_path)
+    if ingest_state.get("file_size") != file_stat.st_size:
+        return False
+    if ingest_state.get("file_mtime") == file_stat.st_mtime:
+        return True
+    if ingest_state.get("file_hash") != compute_file_hash(file_path):
+        return False
+    save_ingest_state(dict(ingest_state, file_mtime=file_stat.st_mtime))
+    return True
+
+# --- Background ingestion jobs ---
+ingestion_executor = ThreadPoolExecutor(max_workers=INGEST_MAX_WORKERS, thread_name_prefix="ingest")
+ingestion_jobs: Dict[str, Dict[str, Any]] = {}
+ingestion_jobs_lock = threading.Lock()
+
+def save_ingestion_job(job: Dict[str, Any]):
+    """Publishes the job to the shared state so any worker process can answer /ingest/<job_id>."""
+    if shared_state is None:
+        return
+    try:
+        shared_state.save_job(job, INGEST_MAX_TRACKED_JOBS)
+    except Exception as e:
+        app.logger.warning(f"Could not save ingestion job {job['job_id']} to the shared state: {e}")
+
+def _sync_ingestion_job(job: Dict[str, Any]):
+    while job["status"] in ("queued", "running"):
+        save_ingestion_job(job)
+        time.sleep(INGEST_JOB_SYNC_SECONDS)
+
+def _run_ingestion_job(job: Dict[str, Any]):
+    job.update(status="running", stage="starting", started_at=time.time())
+    threading.Thread(target=_sync_ingestion_job, args=(job,), name=f"ingest-sync-{job['job_id'][:8]}", daemon=True).start()
+    try:
+        succeeded = ensure_data_is_ingested(job["file_path"], force_reingest=True, progress=job)
+        job.update(status="completed" if succeeded else "failed", stage="done" if succeeded else "failed")
+        if not succeeded:
+            job["error"] = "Ingestion failed. Check server logs for details."
+    except Exception as e:
+        app.logger.error(f"Ingestion job {job['job_id']} crashed: {e}", exc_info=True)
+        job.update(status="failed", stage="failed", error=str(e))
+    finally:
+        job["finished_at"] = time.time()
+        if job.get("remove_files"):
+            remove_uploaded_order_files(job["file_path"])
+        save_ingestion_job(job)
+        app.logger.info(f"Ingestion job {job['job_id']} finished with status '{job['status']}'.")
+
+def submit_ingestion_job(file_path: Union[str, List[str]], remove_files: bool = False) -> Dict[str, Any]:
+    """Queues an ingestion. With `remove_files` the file(s) are deleted once the job ends: the catalog, its ingest
+    state and the aggregated snapshot are all that later ingestions need."""
+    job = {
+        "job_id": uuid.uuid4().hex, "file_path": file_path, "remove_files": remove_files,
+        "status": "queued", "stage": "queued", "rows_processed": 0, "products_found": None,
+        "batches_total": None, "batches_embedded": 0, "submitted_at": time.time(),
+        "started_at": None, "finished_at": None, "error": None,
+    }
+    with ingestion_jobs_lock:
+        ingestion_jobs[job["job_id"]] = job
+        finished_job_ids = [job_id for job_id, j in ingestion_jobs.items() if j["status"] in ("completed", "failed")]
+        for job_id in finished_job_ids[:max(0, len(ingestion_jobs) - INGEST_MAX_TRACKED_JOBS)]:
+            del ingestion_jobs[job_id]
+    save_ingestion_job(job)
+    ingestion_executor.submit(_run_ingestion_job, job)
+    app.logger.info(f"Queued ingestion job {job['job_id']} for '{file_path}'.")
+    return job
+
+def save_uploaded_order_file(file_obj) -> Optional[str]:
+    """Saves an uploaded order export under a unique name and returns its path, or None if the type is unsupported."""
+    filename = secure_filename(file_obj.filename or "")
+    if not filename.lower().endswith(ORDER_DATA_FILE_EXTENSIONS):
+        return None
+    file_path = os.path.join(app.config["UPLOAD_FOLDER"], f"{uuid.uuid4().hex}_{filename}")
+    file_obj.save(file_path)
+    return file_path
+
+def remove_uploaded_order_files(file_path: Union[str, List[str], None]):
+    for path in [file_path] if isinstance(file_path, str) else file_path or []:
+        if path is None:
+            continue
+        try:
+            os.remove(path)
+        except OSError as e:
+            app.logger.warning(f"Could not remove uploaded order file '{path}': {e}")
+
+startup_ingestion_job: Optional[Dict[str, Any]] = None
+startup_ingest_lock_file = None
+
+def claim_startup_ingestion() -> bool:
+    """Elects one worker process as the owner of startup ingestion. The owner keeps the lock file locked for its
+    lifetime; the OS releases it when the process exits, so a replacement worker can take over."""
+    global startup_ingest_lock_file
+    if startup_ingest_lock_file is not None or fcntl is None:
+        return True
+    lock_file = open(STARTUP_INGEST_LOCK_PATH, "a")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        lock_file.close()
+        return False
+    startup_ingest_lock_file = lock_file
+    return True
+
+def start_default_data_ingestion():
+    """Startup ingestion of DEFAULT_DATA_FILE_PATH, queued in the background and skipped when the catalog is current."""
+    global startup_ingestion_job
+    if not claim_startup_ingestion():
+        app.logger.info("Another worker process owns startup ingestion. Skipping it in this one.")
         return
-    collection_is_empty = product_collection.count() == 0
-    if force_reingest or collection_is_empty:
-        action = "Re-ingesting" if force_reingest and not collection_is_empty else "Ingesting"
-        app.logger.info(f"ChromaDB: {action} data from '{file_path}' (Force:{force_reingest}, Empty:{collection_is_empty}).")
-        process_and_ingest_excel_to_chroma(file_path)
+    drop_orphaned_catalog_generations()
+    if not os.path.exists(DEFAULT_DATA_FILE_PATH):
+        app.logger.warning(f"Default data file '{DEFAULT_DATA_FILE_PATH}' not found. Startup ingestion skipped.")
+    elif ingested_file_is_current(DEFAULT_DATA_FILE_PATH):
+        app.logger.info(f"Persisted catalog '{active_collection_name}' matches '{DEFAULT_DATA_FILE_PATH}'. Startup ingestion skipped.")
     else:
-        app.logger.info(f"ChromaDB '{CHROMA_COLLECTION_NAME}' has {product_collection.count()} items. Default ingestion skipped.")
+        startup_ingestion_job = submit_ingestion_job(DEFAULT_DATA_FILE_PATH)
+        app.logger.info(f"Queued startup ingestion of '{DEFAULT_DATA_FILE_PATH}' as job {startup_ingestion_job['job_id']}.")
+
+def describe_ingestion_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    eta_seconds = None
+    if job["status"] == "running" and job.get("stage") == "embedding" and job.get("batches_total"):
+        batches_done = job.get("batches_embedded") or 0
+        elapsed = time.time() - job["embedding_started_at"] if job.get("embedding_started_at") else None
+        if batches_done and elapsed:
+            eta_seconds = round(elapsed / batches_done * (job["batches_total"] - batches_done), 1)
+    elif job["status"] in ("completed", "failed"):
+        eta_seconds = 0
+    return {
+        "job_id": job["job_id"], "status": job["status"], "stage": job.get("stage"),
+        "rows_processed": job.get("rows_processed"), "products_found": job.get("products_found"),
+        "batches_embedded": job.get("batches_embedded"), "batches_total": job.get("batches_total"),
+        "eta_seconds": eta_seconds, "error": job.get("error"),
+        "elapsed_seconds": round((job["finished_at"] or time.time()) - job["started_at"], 1) if job.get("started_at") else None,
+    }
+
+# --- Bundle output validation and repair ---
+class BundleRepairError(ValueError):
+    """Raised when an LLM bundle cannot be reconciled with the catalog locally."""
+
+catalog_sku_index: Dict[str, Any] = {"collection_name": None, "by_sku": {}, "sku_by_name": {}}
+bundle_validation_stats = {"valid": 0, "repaired": 0, "retried": 0, "failed": 0}
+bundle_validation_stats_lock = threading.Lock()
+
+def set_catalog_sku_index(collection_name: str, metadatas: List[Dict[str, Any]]):
+    global catalog_sku_index
+    by_sku = {m["BaseSKU"]: m for m in metadatas if m.get("BaseSKU")}
+    sku_by_name = {str(m.get("ProductName", "")).strip().lower(): sku for sku, m in by_sku.items()}
+    catalog_sku_index = {"collection_name": collection_name, "by_sku": by_sku, "sku_by_name": sku_by_name}
+
+def get_catalog_sku_index(collection_name: str, collection) -> Dict[str, Any]:
+    """BaseSKU -> metadata lookup for the given catalog generation, loaded from Chroma on first use."""
+    index = catalog_sku_index
+    if index["collection_name"] != collection_name:
+        metadatas: List[Dict[str, Any]] = []
+        offset = 0
+        while True:
+            page = collection.get(limit=EXCEL_PROCESSING_BATCH_SIZE, offset=offset, include=["metadatas"])
+            if not page["ids"]:
+                break
+            metadatas.extend(page["metadatas"])
+            offset += len(page["ids"])
+        set_catalog_sku_index(collection_name, metadatas)
+        index = catalog_sku_index
+        app.logger.info(f"Loaded BaseSKU index for '{collection_name}' with {len(index['by_sku'])} products.")
+    return index
+
+def _as_float(value: Any) -> Optional[float]:
+    try:
+        return float(str(value).replace("€", "").replace("%", "").strip())
+    except (TypeError, ValueError):
+        return None
+
+def repair_bundle_output(bundle: Any, sku_index: Dict[str, Any]):
+    """Reconciles an LLM bundle with the catalog: names and prices come from the catalog, unknown SKUs are dropped
+    and totals are recomputed from discount_percent. Returns (bundle, list of fixes); raises BundleRepairError."""
+    if not isinstance(bundle, dict):
+        raise BundleRepairError("LLM output is not a JSON object.")
+    by_sku, sku_by_name = sku_index["by_sku"], sku_index["sku_by_name"]
+    fixes: List[str] = []
+    skus = bundle.get("skus") if isinstance(bundle.get("skus"), list) else []
+    products = bundle.get("products") if isinstance(bundle.get("products"), list) else []
+    stock_levels = bundle.get("product_stock_levels") if isinstance(bundle.get("product_stock_levels"), list) else []
+    sales_metrics = bundle.get("product_sales_metrics") if isinstance(bundle.get("product_sales_metrics"), list) else []
+
+    resolved = []
+    for position in range(max(len(skus), len(products))):
+        sku = str(skus[position]).strip() if position < len(skus) and skus[position] is not None else ""
+        if sku not in by_sku and position < len(products):
+            sku_from_name = sku_by_name.get(str(products[position]).strip().lower())
+            if sku_from_name:
+                fixes.append(f"resolved SKU '{sku}' from product name")
+                sku = sku_from_name
+        if sku not in by_sku:
+            fixes.append(f"dropped unknown SKU '{sku}'")
+            continue
+        if any(sku == existing_sku for existing_sku, _ in resolved):
+            fixes.append(f"dropped duplicate SKU '{sku}'")
+            continue
+        resolved.append((sku, position))
+    if not resolved:
+        raise BundleRepairError("None of the bundle's products exist in the catalog.")
+
+    repaired_products, repaired_prices, repaired_stock, repaired_sales = [], [], [], []
+    aligned = len(skus) == len(products)
+    for sku, position in resolved:
+        catalog_product = by_sku[sku]
+        catalog_price = round(float(catalog_product.get("Price", 0.0)), 2)
+        repaired_products.append(catalog_product.get("ProductName", f"Product {sku}"))
+        repaired_prices.append(catalog_price)
+        if aligned and position < len(stock_levels) and stock_levels[position]:
+            repaired_stock.append(str(stock_levels[position]))
+        else:
+            repaired_stock.append(catalog_product.get("StockInfo", "Stock data N/A"))
+        if aligned and position < len(sales_metrics) and sales_metrics[position]:
+            repaired_sales.append(str(sales_metrics[position]))
+        else:
+            repaired_sales.append(catalog_product.get("SalesMetrics", "Sales data N/A"))
+    original_prices = bundle.get("price_per_product") if isinstance(bundle.get("price_per_product"), list) else []
+    if [round(p, 2) if isinstance(p, (int, float)) else p for p in original_prices] != repaired_prices:
+        fixes.append("set per-product prices from catalog")
+    if products != repaired_products:
+        fixes.append("set product names from catalog")
+
+    discount_percent = _as_float(bundle.get("discount_percent"))
+    original_total_price = round(sum(repaired_prices), 2)
+    if discount_percent is None:
+        stated_total, stated_original = _as_float(bundle.get("total_price")), _as_float(bundle.get("original_total_price"))
+        discount_percent = (1 - stated_total / stated_original) * 100 if stated_total is not None and stated_original else 0.0
+        fixes.append("derived discount_percent from stated totals")
+    if not 0.0 <= discount_percent <= BUNDLE_MAX_DISCOUNT_PERCENT:
+        discount_percent = min(max(discount_percent, 0.0), BUNDLE_MAX_DISCOUNT_PERCENT)
+        fixes.append("clamped discount_percent")
+    discount_percent = round(discount_percent, 2)
+    total_price = round(original_total_price * (1 - discount_percent / 100), 2)
+    if _as_float(bundle.get("original_total_price")) != original_total_price or _as_float(bundle.get("total_price")) != total_price:
+        fixes.append("recomputed totals")
+
+    repaired = dict(bundle, skus=[sku for sku, _ in resolved], products=repaired_products, price_per_product=repaired_prices,
+                    product_stock_levels=repaired_stock, product_sales_metrics=repaired_sales,
+                    original_total_price=original_total_price, total_price=total_price, discount_percent=discount_percent)
+    try:
+        return BundleOutput.model_validate(repaired).model_dump(), fixes
+    except ValidationError as e:
+        raise BundleRepairError(f"Bundle is missing required fields: {e.errors()[0].get('loc')}") from e
+
+def _record_bundle_validation(status: str):
+    with bundle_validation_stats_lock:
+        bundle_validation_stats[status] += 1
+        stats = dict(bundle_validation_stats)
+    metrics.inc("bundle_validation_total", status=status)
+    app.logger.info(f"Bundle validation: {status}. Totals so far: {stats}.")
+
+def finalize_bundle_output(llm_result: Any, chain_input: Dict[str, str], sku_index: Dict[str, Any],
+                           retrieved_metadatas: Sequence[Dict[str, Any]], invoke=None):
+    """Validates/repairs an LLM bundle against the catalog, re-invoking the LLM once only if it cannot be repaired
+    and its context held products to choose from. Returns (bundle, status) where status is 'valid', 'repaired' or 'retried'."""
+    try:
+        bundle, fixes = repair_bundle_output(llm_result, sku_index)
+        status = "repaired" if fixes else "valid"
+        if fixes:
+            app.logger.info(f"Repaired LLM bundle locally: {'; '.join(fixes)}.")
+        _record_bundle_validation(status)
+        return bundle, status
+    except BundleRepairError as e:
+        if sku_index["by_sku"] == {}:
+            # Nothing to validate against (empty catalog): pass the LLM output through.
+            _record_bundle_validation("valid")
+            return llm_result, "valid"
+        if not retrieved_metadatas:
+            # With no products in the context a retry gets the same empty product data and cannot do better.
+            _record_bundle_validation("failed")
+            raise BundleRepairError(f"{e} No catalog products matched the request, so the bundle was not retried.") from e
+        app.logger.warning(f"LLM bundle not repairable ({e}). Retrying once.")
+        retry_input = dict(chain_input, user_input=(
+            f"{chain_input['user_input']}\n\nYour previous answer was rejected: {e} "
+            "Only use BaseSKUs and product names that appear in the product data."))
+        try:
+            bundle, _ = repair_bundle_output((invoke or chain.invoke)(retry_input), sku_index)
+        except BundleRepairError:
+            _record_bundle_validation("failed")
+            raise
+        _record_bundle_validation("retried")
+        return bundle, "retried"
+
+# --- Application factory ---
+def create_app(ingest_default_data: Optional[bool] = None) -> Flask:
+    """WSGI entry point, e.g. `gunicorn 'app:create_app()'`. Cheap to call before forking: clients, the catalog and
+    the chain are built by init_components() on the first request each worker serves.
+    There is one Flask app per process: routes and hooks are registered on the module-level `app` at import, and
+    create_app() only applies its configuration and returns that instance; calling it again reconfigures the same app."""
+    app.config["INGEST_DEFAULT_DATA"] = INGEST_DEFAULT_DATA_ON_STARTUP if ingest_default_data is None else ingest_default_data
+    return app
+
+@app.before_request
+def start_request_trace():
+    g.trace = RequestTrace(request.headers.get(REQUEST_ID_HEADER, "")[:128] or uuid.uuid4().hex,
+                           request.endpoint or "unmatched", request.method)
+
+@app.before_request
+def init_components_for_request():
+    if request.endpoint not in ("healthz", "metrics_route", "static") and components_pid != os.getpid():
+        with trace_stage("init"):
+            init_components()
+
+@app.after_request
+def finish_request_trace(response):
+    trace = g.get("trace")
+    if trace is None:
+        return response
+    response.headers[REQUEST_ID_HEADER] = trace.request_id
+    if trace.streaming:
+        return response  # Finished by the event generator once the stream ends.
+    if SERVER_TIMING_ENABLED and trace.stages:
+        response.headers["Server-Timing"] = trace.server_timing_header()
+    trace.finish(response.status_code)
+    return response
 
 # --- Flask Routes ---
+@app.route("/healthz", methods=["GET"])
+def healthz():
+    """Liveness: answers without initializing anything."""
+    initialized = components_pid == os.getpid()
+    attempted = initialized or components_attempt["pid"] == os.getpid()
+    return jsonify({"status": "ok", "pid": os.getpid(), "initialized": initialized,
+                    "components": dict(component_status) if attempted else {name: "pending" for name in component_status}})
+
+@app.route("/metrics", methods=["GET"])
+def metrics_route():
+    """Prometheus scrape endpoint (text exposition format 0.0.4)."""
+    return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.route("/readyz", methods=["GET"])
+def readyz():
+    """Readiness: components are initialized (by this request if needed) and the active catalog has products."""
+    components = dict(component_status)
+    product_count = 0
+    if components_ready():
+        try:
+            refresh_active_collection()
+            product_count = product_collection.count()
+            components["catalog"] = "ready" if product_count else "empty"
+        except Exception as e:
+            components["catalog"] = f"error: {e}"
+    else:
+        components["catalog"] = "pending"
+    if startup_ingestion_job is not None and startup_ingestion_job["status"] in ("queued", "running"):
+        components["catalog"] = "ingesting" if not product_count else "ready (ingesting update)"
+    ready = components_ready() and product_count > 0
+    body = {"ready": ready, "components": components, "active_collection": active_collection_name, "product_count": product_count}
+    if startup_ingestion_job is not None:
+        body["startup_ingestion_job"] = describe_ingestion_job(startup_ingestion_job)
+    return jsonify(body), 200 if ready else 503
+
 @app.route("/")
 def index():
     return render_template("index.html")  
 
-@app.route("/generate", methods=["POST"])
-def generate_bundle_route():
-    if not all([lc_openai_embeddings, product_collection, chain]):
-        app.logger.error("Core component not available for generation (Embeddings, ChromaDB, or LLM Chain).")
-        return jsonify({"error": "Server error: Core components not available. Check server logs."}), 500
+@app.route("/ingest", methods=["POST"])
+def start_ingestion_route():
+    # Several 'dataFile' parts are ingested together as one catalog, e.g. one export per year.
+    file_objs = [file_obj for file_obj in request.files.getlist("dataFile") if file_obj and file_obj.filename]
+    if not file_objs:
+        return jsonify({"error": "An order export file ('dataFile') is required."}), 400
+    if product_collection is None:
+        return jsonify({"error": "Server error: ChromaDB collection not available. Check server logs."}), 500
+    file_paths = [save_uploaded_order_file(file_obj) for file_obj in file_objs]
+    if None in file_paths:
+        remove_uploaded_order_files(file_paths)
+        return jsonify({"error": "Unsupported file type. Upload an .xlsx, .csv or .csv.gz order export."}), 400
+    job = submit_ingestion_job(file_paths[0] if len(file_paths) == 1 else file_paths, remove_files=True)
+    return jsonify({"job_id": job["job_id"], "status_url": f"/ingest/{job['job_id']}"}), 202
+
+@app.route("/ingest/<job_id>", methods=["GET"])
+def ingestion_status_route(job_id):
+    job = ingestion_jobs.get(job_id)
+    if job is None and shared_state is not None:
+        job = shared_state.load_job(job_id)  # Submitted to another worker process.
+    if job is None:
+        return jsonify({"error": f"Unknown ingestion job '{job_id}'."}), 404
+    return jsonify(describe_ingestion_job(job))
 
+def read_bundle_request():
+    """Parses a bundle request (JSON or form) and queues ingestion of an uploaded order file. Returns (user_input, ingestion_job)."""
     user_input = None
-    if request.is_json:
-        data = request.get_json(); user_input = data.get("user_input")
-        app.logger.info("Received JSON request for bundle generation.")
-    else: 
-        user_input = request.form.get("user_input")
-        file_obj = request.files.get("dataFile")
-        app.logger.info("Received Form request for bundle generation.")
-        if file_obj and file_obj.filename:
-            filename = secure_filename(file_obj.filename)
-        
-            if filename.endswith((".xlsx", ".xls")):
-                file_path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
-                file_obj.save(file_path)
-                app.logger.info(f"Uploaded Excel: {filename}. Data will be re-ingested into ChromaDB.")
-                ensure_data_is_ingested(file_path, force_reingest=True) 
-            else:
-                app.logger.warning(f"Uploaded file '{filename}' is not an Excel file. Specific ingestion for this type is not yet implemented. Using existing ChromaDB data.")
+    ingestion_job = None
+    file_obj = None
+    with trace_stage("parse_request"):
+        if request.is_json:
+            data = request.get_json(); user_input = data.get("user_input")
+            app.logger.info("Received JSON request for bundle generation.")
+        else: 
+            user_input = request.form.get("user_input")
+            file_obj = request.files.get("dataFile")
+            app.logger.info("Received Form request for bundle generation.")
+    if file_obj and file_obj.filename:
+        with trace_stage("upload"):
+            file_path = save_uploaded_order_file(file_obj)
+        if file_path is not None:
+            # Ingest in the background; this request is answered from the last complete catalog.
+            ingestion_job = submit_ingestion_job(file_path, remove_files=True)
+            app.logger.info(f"Uploaded order file: {file_obj.filename}. Re-ingestion queued as job {ingestion_job['job_id']}.")
         else:
-
+            app.logger.warning(f"Uploaded file '{file_obj.filename}' is not a supported order export (.xlsx, .csv, .csv.gz). Specific ingestion for this type is not yet implemented. Using existing ChromaDB data.")
+    elif not request.is_json:
+        with trace_stage("ensure_ingested"):
             ensure_data_is_ingested(DEFAULT_DATA_FILE_PATH, force_reingest=False)
+    return user_input, ingestion_job
 
-    if not user_input: return jsonify({"error": "User input (prompt) is required"}), 400
+def retrieve_bundle_context(collection, user_input: str) -> Dict[str, Any]:
+    """Queries the catalog for the prompt and builds the LLM context. Returns context, prompt_embedding, retrieved_skus and retrieved_metadatas."""
+    return retrieve_bundle_contexts(collection, [user_input])[0]
 
-    try:
-        num_items_in_collection = product_collection.count()
-        if num_items_in_collection == 0:
-            final_context_for_llm = ("No product data in ChromaDB. Upload Excel or check default load. "
-                                     "Bundle based on general knowledge or user prompt details, or state data missing.")
-            app.logger.warning("ChromaDB empty. LLM context minimal for bundle generation.")
-        else:
-            app.logger.info(f"Querying ChromaDB for products relevant to: '{user_input[:100]}...'")
+def retrieve_bundle_contexts(collection, user_inputs: List[str]) -> List[Dict[str, Any]]:
+    """Batched retrieve_bundle_context: one embedding call and one Chroma query for all prompts."""
+    num_items_in_collection = collection.count()
+    if num_items_in_collection == 0:
+        app.logger.warning("ChromaDB empty. LLM context minimal for bundle generation.")
+        return [build_bundle_context(user_input, None, None, None) for user_input in user_inputs]
 
-            query_results = product_collection.query(
-                query_texts=[user_input],
+    app.logger.info(f"Querying ChromaDB for products relevant to {len(user_inputs)} prompt(s), first: '{user_inputs[0][:100]}...'")
+    # Embedded once through the cached embedding function and reused for the response cache lookup.
+    with trace_stage("embed_query"):
+        prompt_embeddings = chroma_openai_ef(list(user_inputs))
+    index = lexical_index
+    constraints_per_prompt = [extract_query_constraints(user_input, index.categories if index else []) for user_input in user_inputs]
+
+    # Prompts with identical constraints share one filtered multi-query call.
+    prompts_by_constraints: Dict[str, List[int]] = {}
+    for i, constraints in enumerate(constraints_per_prompt):
+        prompts_by_constraints.setdefault(json.dumps(constraints, sort_keys=True), []).append(i)
+    vector_ids: List[List[str]] = [[] for _ in user_inputs]
+    metadata_by_id: Dict[str, Dict[str, Any]] = {}
+    with trace_stage("vector_query"):
+        for prompt_indices in prompts_by_constraints.values():
+            constraints = constraints_per_prompt[prompt_indices[0]]
+            where = constraints_to_chroma_where(constraints)
+            if where:
+                app.logger.info(f"Pushing down retrieval filters {where} for {len(prompt_indices)} prompt(s).")
+            query_results = collection.query(
+                query_embeddings=[prompt_embeddings[i] for i in prompt_indices],
                 n_results=min(LLM_CONTEXT_PRODUCT_LIMIT, num_items_in_collection), 
+                where=where,
+                include=["metadatas"]
+            )
+            for result_position, i in enumerate(prompt_indices):
+                ids = (query_results.get('ids') or [[]] * len(prompt_indices))[result_position]
+                metadatas = (query_results.get('metadatas') or [[]] * len(prompt_indices))[result_position] or []
+                vector_ids[i] = list(ids)
+                metadata_by_id.update(zip(ids, metadatas))
+        # Filters read from free text can be wrong or too strict for the catalog; rather than answering from an
+        # empty or near-empty context, those prompts are topped up with unfiltered hits after the filtered ones.
+        relaxed_indices = [i for i, constraints in enumerate(constraints_per_prompt)
+                           if constraints_to_chroma_where(constraints) and len(vector_ids[i]) < min(RETRIEVAL_MIN_FILTERED_RESULTS, num_items_in_collection)]
+        if relaxed_indices:
+            app.logger.info(f"Filtered retrieval found too few products for {len(relaxed_indices)} prompt(s). Retrying without filters.")
+            query_results = collection.query(
+                query_embeddings=[prompt_embeddings[i] for i in relaxed_indices],
+                n_results=min(LLM_CONTEXT_PRODUCT_LIMIT, num_items_in_collection),
                 include=["metadatas"]
             )
+            for result_position, i in enumerate(relaxed_indices):
+                ids = (query_results.get('ids') or [[]] * len(relaxed_indices))[result_position]
+                metadatas = (query_results.get('metadatas') or [[]] * len(relaxed_indices))[result_position] or []
+                vector_ids[i] = vector_ids[i] + [item_id for item_id in ids if item_id not in vector_ids[i]]
+                metadata_by_id.update(zip(ids, metadatas))
+                constraints_per_prompt[i] = {key: value for key, value in constraints_per_prompt[i].items() if key == "popular"}
 
-            if not query_results or not query_results['ids'] or not query_results['ids'][0]:
-                 app.logger.warning("No relevant products found in ChromaDB for the query, or query failed. LLM context will be minimal.")
-                 final_context_for_llm = "No specific products found matching your request. Please try a different prompt or ensure data is loaded."
-            else:
-                context_parts_from_chroma = ["Relevant product information from ChromaDB:"]
-               
-                retrieved_metadatas = query_results['metadatas'][0] if query_results['metadatas'] else []
+    with trace_stage("lexical_query"):
+        result_ids: List[List[str]] = []
+        for i, user_input in enumerate(user_inputs):
+            lexical_ids = index.search(user_input, LLM_CONTEXT_PRODUCT_LIMIT, constraints_per_prompt[i]) if index else []
+            rankings = [vector_ids[i], lexical_ids]
+            if constraints_per_prompt[i].get("popular"):
+                # Best sellers among the vector hits are fused in as a third ranking, so they rise without
+                # excluding anything.
+                rankings.append(sorted(vector_ids[i], key=lambda item_id: -(metadata_by_id[item_id].get("TotalSold") or 0)))
+            result_ids.append(reciprocal_rank_fusion(rankings)[:HYBRID_RESULT_LIMIT])
+        lexical_only_ids = sorted({item_id for ids in result_ids for item_id in ids if item_id not in metadata_by_id})
+        if lexical_only_ids:
+            fetched = collection.get(ids=lexical_only_ids, include=["metadatas"])
+            metadata_by_id.update(zip(fetched["ids"], fetched["metadatas"]))
+    result_ids = [[item_id for item_id in ids if item_id in metadata_by_id] for ids in result_ids]
+    result_metadatas = [[metadata_by_id[item_id] for item_id in ids] for ids in result_ids]
+    with trace_stage("copurchase_expansion"):
+        result_ids, result_metadatas = expand_with_copurchase_partners(collection, result_ids, result_metadatas, constraints_per_prompt)
+    with trace_stage("context_build"):
+        return [
+            build_bundle_context(user_inputs[i], prompt_embeddings[i],
+                                 result_ids[i] if i < len(result_ids) else None,
+                                 result_metadatas[i] if i < len(result_metadatas) else None)
+            for i in range(len(user_inputs))
+        ]
 
-                if not retrieved_metadatas:
-                    app.logger.warning("Query returned results but no metadatas. LLM context will be minimal.")
-                    final_context_for_llm = "Found some items but could not retrieve details. Please check data integrity."
-                else:
-                    for metadata_item in retrieved_metadatas:
-                        base_sku = metadata_item.get("BaseSKU", "N/A")
-                        product_name = metadata_item.get("ProductName", f"Product {base_sku}")
-                        price_val = metadata_item.get("Price", 0.0)
-                        category = metadata_item.get("Category", "N/A")
-                        sales_metrics_note = metadata_item.get("SalesMetrics", "Sales data N/A")
-                        stock_info_note = metadata_item.get("StockInfo", "Stock data N/A") 
-
-                        price_display = f"€{price_val:.2f}" if isinstance(price_val, (int, float)) else "Price N/A"
-
-                        context_parts_from_chroma.append(f"\n---\nProduct Name: {product_name} (BaseSKU: {base_sku})")
-                        context_parts_from_chroma.append(f"Price: {price_display}")
-                        context_parts_from_chroma.append(f"Category: {category}")
-                        context_parts_from_chroma.append(f"Stock Info: {stock_info_note}")
-                        context_parts_from_chroma.append(f"Sales Info: {sales_metrics_note}")
-                    final_context_for_llm = "\n".join(context_parts_from_chroma)
+def expand_with_copurchase_partners(collection, result_ids: List[List[str]], result_metadatas: List[List[Dict[str, Any]]],
+                                    constraints_per_prompt: List[Dict[str, Any]]):
+    """Appends frequently-bought-together partners of each prompt's top hits to its retrieved products."""
+    index = copurchase_index
+    if index is None or not result_ids:
+        return result_ids, result_metadatas
+    expansion_ids_per_prompt = []
+    for ids in result_ids:
+        seen = set(ids)
+        expansion_ids = []
+        for seed_sku in ids[:COPURCHASE_EXPANSION_SEEDS]:
+            for partner in index.partners(seed_sku, limit=COPURCHASE_PARTNERS_PER_SEED):
+                if partner["sku"] not in seen and len(expansion_ids) < COPURCHASE_CONTEXT_EXPANSION_LIMIT:
+                    seen.add(partner["sku"])
+                    expansion_ids.append(partner["sku"])
+        expansion_ids_per_prompt.append(expansion_ids)
+
+    all_expansion_ids = sorted({sku for ids in expansion_ids_per_prompt for sku in ids})
+    if not all_expansion_ids:
+        return result_ids, result_metadatas
+    fetched = collection.get(ids=all_expansion_ids, include=["metadatas"])
+    metadata_by_id = dict(zip(fetched["ids"], fetched["metadatas"]))
+    expanded_ids, expanded_metadatas = [], []
+    for ids, metadatas, expansion_ids, constraints in zip(result_ids, result_metadatas, expansion_ids_per_prompt, constraints_per_prompt):
+        found_ids = [sku for sku in expansion_ids if sku in metadata_by_id and product_matches_constraints(metadata_by_id[sku], constraints)]
+        expanded_ids.append(list(ids) + found_ids)
+        expanded_metadatas.append(list(metadatas) + [metadata_by_id[sku] for sku in found_ids])
+    app.logger.info(f"Co-purchase expansion added {sum(len(ids) for ids in expansion_ids_per_prompt)} partner products across {len(result_ids)} prompt(s).")
+    return expanded_ids, expanded_metadatas
+
+def build_bundle_context(user_input: str, prompt_embedding, query_ids: Optional[List[str]], query_metadatas: Optional[List[Dict[str, Any]]]) -> Dict[str, Any]:
+    retrieved_skus: List[str] = []
+    retrieved_metadatas: List[Dict[str, Any]] = []
+    if prompt_embedding is None:
+        final_context_for_llm = ("No product data in ChromaDB. Upload Excel or check default load. "
+                                 "Bundle based on general knowledge or user prompt details, or state data missing.")
+    elif not query_ids:
+        app.logger.warning("No relevant products found in ChromaDB for the query, or query failed. LLM context will be minimal.")
+        final_context_for_llm = "No specific products found matching your request. Please try a different prompt or ensure data is loaded."
+    elif not query_metadatas:
+        app.logger.warning("Query returned results but no metadatas. LLM context will be minimal.")
+        final_context_for_llm = "Found some items but could not retrieve details. Please check data integrity."
+    else:
+        budget = context_token_budget()
+        final_context_for_llm, retrieved_metadatas, context_tokens = build_compact_product_context(query_metadatas, budget)
+        retrieved_skus = sorted(m.get("BaseSKU", "") for m in retrieved_metadatas)
+        app.logger.info(f"Context: {len(retrieved_metadatas)}/{len(query_metadatas)} products in {context_tokens} tokens (budget {budget}).")
+
+    prompt_tokens = count_tokens(prompt.format(context=final_context_for_llm, user_input=user_input)) if prompt is not None else None
+    app.logger.info(f"Prompt tokens for LLM: {prompt_tokens}.")
+    return {"context": final_context_for_llm, "prompt_embedding": prompt_embedding, "prompt_tokens": prompt_tokens,
+            "retrieved_skus": retrieved_skus, "retrieved_metadatas": retrieved_metadatas}
+
+def bundle_cache_scope(collection_name: str, retrieved_skus: List[str]) -> tuple:
+    return (getattr(model, "model_name", ""), PROMPT_TEMPLATE_VERSION, collection_name, tuple(retrieved_skus))
+
+@app.route("/copurchase/<sku>", methods=["GET"])
+def copurchase_lookup_route(sku):
+    # Adopts the co-purchase index of a generation another worker process activated.
+    refresh_active_collection()
+    if copurchase_index is None:
+        return jsonify({"error": "Co-purchase index not built yet. Ingest order data first."}), 503
+    metric = request.args.get("metric", "lift")
+    if metric not in CoPurchaseIndex.METRICS:
+        return jsonify({"error": f"'metric' must be one of {list(CoPurchaseIndex.METRICS)}."}), 400
+    limit = request.args.get("limit", 10, type=int)
+    return jsonify({"sku": sku, "metric": metric, "partners": copurchase_index.partners(sku, limit=max(1, min(limit, 100)), metric=metric)})
+
+@app.route("/generate", methods=["POST"])
+def generate_bundle_route():
+    if not all([lc_openai_embeddings, product_collection, chain]):
+        app.logger.error("Core component not available for generation (Embeddings, ChromaDB, or LLM Chain).")
+        return jsonify({"error": "Server error: Core components not available. Check server logs."}), 500
+
+    user_input, ingestion_job = read_bundle_request()
+    if not user_input: return jsonify({"error": "User input (prompt) is required"}), 400
+
+    pinned_collection_name, collection = pin_active_collection()
+    try:
+        retrieval = retrieve_bundle_context(collection, user_input)
+        final_context_for_llm = retrieval["context"]
         
-        app.logger.info(f"Invoking LLM for bundle generation. User input: '{user_input[:100]}...'")
-        app.logger.debug(f"Final context for LLM (first 400 chars): {final_context_for_llm[:400]}...")
+        cache_scope = bundle_cache_scope(pinned_collection_name, retrieval["retrieved_skus"])
+        with trace_stage("cache_lookup"):
+            llm_result, cache_status = bundle_response_cache.get(cache_scope, user_input, retrieval["prompt_embedding"])
+        if llm_result is not None:
+            app.logger.info(f"Bundle response served from cache ({cache_status} match).")
+        else:
+            app.logger.info(f"Invoking LLM for bundle generation. User input: '{user_input[:100]}...'")
+            app.logger.debug(f"Final context for LLM (first 400 chars): {final_context_for_llm[:400]}...")
 
-        llm_result = chain.invoke({"user_input": user_input, "context": final_context_for_llm})
-        app.logger.info("LLM invocation successful.")
-        return jsonify(llm_result)
+            chain_input = {"user_input": user_input, "context": final_context_for_llm}
+            with trace_stage("llm"):
+                llm_result = chain.invoke(chain_input)
+            app.logger.info("LLM invocation successful.")
+            record_llm_tokens(retrieval["prompt_tokens"], llm_result)
+            with trace_stage("validation"):
+                llm_result, validation_status = finalize_bundle_output(
+                    llm_result, chain_input, get_catalog_sku_index(pinned_collection_name, collection), retrieval["retrieved_metadatas"])
+            bundle_response_cache.put(cache_scope, user_input, retrieval["prompt_embedding"], llm_result)
+        response = jsonify(llm_result)
+        if cache_status == "miss":
+            response.headers["X-Bundle-Validation"] = validation_status
+        response.headers["X-Bundle-Cache"] = "miss" if cache_status == "miss" else f"hit-{cache_status}"
+        if ingestion_job is not None:
+            response.headers["X-Ingestion-Job-Id"] = ingestion_job["job_id"]
+        return response
+    except BundleRepairError as e:
+        app.logger.error(f"LLM bundle failed validation: {e}")
+        return jsonify({"error": f"Could not generate a valid bundle from the catalog: {str(e)}"}), 502
     except Exception as e:
         app.logger.error(f"Error during bundle generation: {e}", exc_info=True)
         return jsonify({"error": f"Internal error during bundle generation: {str(e)}"}), 500
+    finally:
+        unpin_collection(pinned_collection_name)
+
+def format_sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route("/generate/stream", methods=["POST"])
+def generate_bundle_stream_route():
+    """Server-Sent Events variant of /generate: a 'retrieval' event, then 'partial' bundle objects as the
+    LLM output parses, then one 'final' validated bundle (or an 'error' event)."""
+    if not all([lc_openai_embeddings, product_collection, chain]):
+        app.logger.error("Core component not available for generation (Embeddings, ChromaDB, or LLM Chain).")
+        return jsonify({"error": "Server error: Core components not available. Check server logs."}), 500
+
+    user_input, ingestion_job = read_bundle_request()
+    if not user_input: return jsonify({"error": "User input (prompt) is required"}), 400
+
+    trace = current_trace()
+    trace.streaming = True
+
+    def generate_events():
+        pinned_collection_name, collection = pin_active_collection()
+        try:
+            retrieval = retrieve_bundle_context(collection, user_input)
+            yield format_sse_event("retrieval", {"products": [
+                {"sku": metadata.get("BaseSKU"), "name": metadata.get("ProductName"), "price": metadata.get("Price"),
+                 "category": metadata.get("Category")}
+                for metadata in retrieval["retrieved_metadatas"]
+            ]})
+
+            cache_scope = bundle_cache_scope(pinned_collection_name, retrieval["retrieved_skus"])
+            with trace_stage("cache_lookup"):
+                llm_result, cache_status = bundle_response_cache.get(cache_scope, user_input, retrieval["prompt_embedding"])
+            if llm_result is not None:
+                app.logger.info(f"Streamed bundle response served from cache ({cache_status} match).")
+                yield format_sse_event("final", {"bundle": llm_result, "cache": f"hit-{cache_status}"})
+                return
+
+            app.logger.info(f"Streaming LLM bundle generation. User input: '{user_input[:100]}...'")
+            chain_input = {"user_input": user_input, "context": retrieval["context"]}
+            latest_partial = None
+            # JsonOutputParser yields the cumulative object parsed so far on every chunk.
+            with trace_stage("llm"):
+                for partial in chain.stream(chain_input):
+                    if partial and partial != latest_partial:
+                        latest_partial = partial
+                        yield format_sse_event("partial", partial)
+
+            if latest_partial is None:
+                yield format_sse_event("error", {"error": "The LLM returned no parsable bundle."})
+                return
+            app.logger.info("LLM streaming invocation successful.")
+            record_llm_tokens(retrieval["prompt_tokens"], latest_partial)
+            with trace_stage("validation"):
+                llm_result, validation_status = finalize_bundle_output(
+                    latest_partial, chain_input, get_catalog_sku_index(pinned_collection_name, collection), retrieval["retrieved_metadatas"])
+            bundle_response_cache.put(cache_scope, user_input, retrieval["prompt_embedding"], llm_result)
+            yield format_sse_event("final", {"bundle": llm_result, "cache": "miss", "validation": validation_status})
+        except Exception as e:
+            app.logger.error(f"Error during streamed bundle generation: {e}", exc_info=True)
+            yield format_sse_event("error", {"error": f"Internal error during bundle generation: {str(e)}"})
+        finally:
+            unpin_collection(pinned_collection_name)
+            trace.finish(200)
+
+    response = Response(stream_with_context(generate_events()), mimetype="text/event-stream")
+    response.headers["Cache-Control"] = "no-cache"
+    response.headers["X-Accel-Buffering"] = "no"
+    if ingestion_job is not None:
+        response.headers["X-Ingestion-Job-Id"] = ingestion_job["job_id"]
+    return response
+
+def invoke_chain_with_backoff(chain_input: Dict[str, str], prompt_tokens: Optional[int] = None) -> Dict[str, Any]:
+    """chain.invoke under the shared tokens-per-minute budget, retrying rate-limit errors with jittered exponential backoff."""
+    if prompt_tokens is None:
+        prompt_tokens = count_tokens(chain_input["context"]) + count_tokens(chain_input["user_input"])
+    estimated_tokens = prompt_tokens + LLM_ESTIMATED_OUTPUT_TOKENS
+    for attempt in range(LLM_RATE_LIMIT_MAX_RETRIES + 1):
+        llm_rate_limiter.acquire(estimated_tokens)
+        try:
+            return chain.invoke(chain_input)
+        except RateLimitError:
+            if attempt == LLM_RATE_LIMIT_MAX_RETRIES:
+                raise
+            backoff_seconds = LLM_RATE_LIMIT_BACKOFF_SECONDS * (2 ** attempt) * (1 + random.random())
+            app.logger.warning(f"LLM rate limited (attempt {attempt + 1}). Retrying in {backoff_seconds:.1f}s.")
+            time.sleep(backoff_seconds)
+
+def record_llm_tokens(prompt_tokens: Optional[int], llm_result: Any, trace: Optional[RequestTrace] = None):
+    trace = trace or current_trace()
+    route = trace.route if trace is not None else "background"
+    if prompt_tokens is not None:
+        metrics.observe("llm_prompt_tokens", prompt_tokens, buckets=TOKEN_BUCKETS, route=route)
+    metrics.observe("llm_completion_tokens", count_tokens(json.dumps(llm_result, ensure_ascii=False)), buckets=TOKEN_BUCKETS, route=route)
+
+def generate_validated_bundle(chain_input: Dict[str, str], prompt_tokens: Optional[int], sku_index: Dict[str, Any],
+                              retrieved_metadatas: Sequence[Dict[str, Any]], trace: Optional[RequestTrace] = None):
+    with trace_stage("llm", trace):
+        llm_result = invoke_chain_with_backoff(chain_input, prompt_tokens)
+    record_llm_tokens(prompt_tokens, llm_result, trace)
+    with trace_stage("validation", trace):
+        return finalize_bundle_output(llm_result, chain_input, sku_index, retrieved_metadatas,
+                                      invoke=lambda retry_input: invoke_chain_with_backoff(retry_input))
+
+@app.route("/generate/batch", methods=["POST"])
+def generate_bundle_batch_route():
+    """Generates one bundle per prompt in {"prompts": [...]}, reporting success or failure per prompt."""
+    if not all([lc_openai_embeddings, product_collection, chain]):
+        app.logger.error("Core component not available for generation (Embeddings, ChromaDB, or LLM Chain).")
+        return jsonify({"error": "Server error: Core components not available. Check server logs."}), 500
+
+    data = request.get_json(silent=True) or {}
+    prompts = data.get("prompts")
+    if not isinstance(prompts, list) or not prompts or not all(isinstance(p, str) and p.strip() for p in prompts):
+        return jsonify({"error": "'prompts' must be a non-empty list of non-empty strings."}), 400
+    if len(prompts) > LLM_BATCH_MAX_PROMPTS:
+        return jsonify({"error": f"At most {LLM_BATCH_MAX_PROMPTS} prompts are allowed per batch."}), 400
+    with trace_stage("ensure_ingested"):
+        ensure_data_is_ingested(DEFAULT_DATA_FILE_PATH, force_reingest=False)
+
+    pinned_collection_name, collection = pin_active_collection()
+    try:
+        started_at = time.perf_counter()
+        try:
+            retrievals = retrieve_bundle_contexts(collection, prompts)
+        except Exception as e:
+            app.logger.error(f"Error during batched retrieval: {e}", exc_info=True)
+            return jsonify({"error": f"Internal error during product retrieval: {str(e)}"}), 500
+
+        sku_index = get_catalog_sku_index(pinned_collection_name, collection)
+        results: List[Optional[Dict[str, Any]]] = [None] * len(prompts)
+        futures = {}
+        for i, (user_input, retrieval) in enumerate(zip(prompts, retrievals)):
+            cache_scope = bundle_cache_scope(pinned_collection_name, retrieval["retrieved_skus"])
+            with trace_stage("cache_lookup"):
+                llm_result, cache_status = bundle_response_cache.get(cache_scope, user_input, retrieval["prompt_embedding"])
+            if llm_result is not None:
+                results[i] = {"index": i, "user_input": user_input, "status": "ok", "cache": f"hit-{cache_status}", "bundle": llm_result}
+            else:
+                future = llm_executor.submit(generate_validated_bundle, {"user_input": user_input, "context": retrieval["context"]},
+                                             retrieval["prompt_tokens"], sku_index, retrieval["retrieved_metadatas"], current_trace())
+                futures[future] = (i, user_input, cache_scope, retrieval["prompt_embedding"])
+
+        for future, (i, user_input, cache_scope, prompt_embedding) in futures.items():
+            try:
+                llm_result, validation_status = future.result()
+                bundle_response_cache.put(cache_scope, user_input, prompt_embedding, llm_result)
+                results[i] = {"index": i, "user_input": user_input, "status": "ok", "cache": "miss",
+                              "validation": validation_status, "bundle": llm_result}
+            except Exception as e:
+                app.logger.error(f"Batch prompt {i} failed: {e}", exc_info=True)
+                results[i] = {"index": i, "user_input": user_input, "status": "error", "error": str(e)}
+
+        failed = sum(1 for r in results if r["status"] == "error")
+        app.logger.info(f"Batch generation of {len(prompts)} prompts finished in {time.perf_counter() - started_at:.1f}s ({failed} failed, {len(futures)} LLM calls).")
+        return jsonify({"results": results, "succeeded": len(prompts) - failed, "failed": failed})
+    finally:
+        unpin_collection(pinned_collection_name)
 
 if __name__ == "__main__":
-    if not all([lc_openai_embeddings, chroma_client, product_collection, model, chain]):
-        app.logger.critical("Core components failed init. App cannot run. Exiting.")
-        exit(1)
+    if not os.environ.get("OPENAI_API_KEY"):
+        os.environ["OPENAI_API_KEY"] = getpass("Enter your OpenAI API Key: ")
 
     if not os.path.exists(DEFAULT_DATA_FILE_PATH):
         app.logger.info(f"Default data file {DEFAULT_DATA_FILE_PATH} not found. Creating dummy Excel.")
@@ -415,5 +2576,8 @@ if __name__ == "__main__":
         except ImportError: app.logger.error("openpyxl not installed. Cannot create dummy .xlsx.")
         except Exception as e: app.logger.error(f"Could not create dummy Excel: {e}", exc_info=True)
 
-    ensure_data_is_ingested(DEFAULT_DATA_FILE_PATH, force_reingest=True)
+    create_app(ingest_default_data=True)
+    if not init_components():
+        app.logger.critical("Core components failed init. App cannot run. Exiting.")
+        exit(1)
     app.run(debug=True, use_reloader=False)
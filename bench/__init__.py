@@ -0,0 +1 @@
+"""Offline benchmarks for the bundle generator: synthetic order exports, local OpenAI stand-ins and a runner."""
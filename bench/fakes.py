@@ -0,0 +1,135 @@
+"""Deterministic local stand-ins for the OpenAI embedding function, OpenAIEmbeddings and ChatOpenAI.
+
+Embeddings are feature-hashed bags of words, so texts that share words are close and retrieval behaves plausibly.
+The chat model answers with a bundle built from the first rows of the product table in its prompt, so bundles
+pass catalog validation. Both sleep for a configurable latency to stand in for the network round trip.
+"""
+import functools
+import hashlib
+import json
+import re
+import time
+import types
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from chromadb.api.types import Documents, EmbeddingFunction, Embeddings
+from langchain_core.embeddings import Embeddings as LangChainEmbeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+FAKE_EMBEDDING_DIMENSIONS = 256
+FAKE_BUNDLE_SIZE = 3
+FAKE_DISCOUNT_PERCENT = 10.0
+_WORD = re.compile(r"[a-z0-9]+")
+
+@functools.lru_cache(maxsize=200000)
+def _word_vector(word: str, dimensions: int) -> np.ndarray:
+    seed = int.from_bytes(hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+    return np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+
+def fake_embedding(text: str, dimensions: int = FAKE_EMBEDDING_DIMENSIONS) -> np.ndarray:
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in _WORD.findall(text.lower()):
+        vector += _word_vector(word, dimensions)
+    norm = float(np.linalg.norm(vector))
+    return vector / norm if norm else vector
+
+class FakeEmbeddingFunction(EmbeddingFunction[Documents]):
+    """Chroma embedding function standing in for OpenAIEmbeddingFunction."""
+
+    def __init__(self, latency_seconds: float = 0.0, per_text_latency_seconds: float = 0.0,
+                 dimensions: int = FAKE_EMBEDDING_DIMENSIONS):
+        self.latency_seconds = latency_seconds
+        self.per_text_latency_seconds = per_text_latency_seconds
+        self.dimensions = dimensions
+        self.calls = 0
+        self.texts = 0
+
+    def __call__(self, input: Documents) -> Embeddings:
+        self.calls += 1
+        self.texts += len(input)
+        time.sleep(self.latency_seconds + self.per_text_latency_seconds * len(input))
+        return [fake_embedding(text, self.dimensions) for text in input]
+
+    @staticmethod
+    def name() -> str:
+        return "bench_fake"
+
+    def get_config(self) -> Dict[str, Any]:
+        return {"latency_seconds": self.latency_seconds, "per_text_latency_seconds": self.per_text_latency_seconds,
+                "dimensions": self.dimensions}
+
+    @staticmethod
+    def build_from_config(config: Dict[str, Any]) -> "FakeEmbeddingFunction":
+        return FakeEmbeddingFunction(**config)
+
+class FakeOpenAIEmbeddings(LangChainEmbeddings):
+    """LangChain embeddings standing in for OpenAIEmbeddings."""
+
+    def __init__(self, **_):
+        pass
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [fake_embedding(text).tolist() for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return fake_embedding(text).tolist()
+
+def _product_rows(prompt_text: str) -> List[Dict[str, str]]:
+    lines = [line.strip() for line in prompt_text.splitlines()]
+    header_idx = next((i for i, line in enumerate(lines) if line.startswith("BaseSKU |")), None)
+    if header_idx is None:
+        return []
+    header = [cell.strip() for cell in lines[header_idx].split("|")]
+    rows = []
+    for line in lines[header_idx + 1:]:
+        if "|" not in line:
+            break
+        rows.append(dict(zip(header, (cell.strip() for cell in line.split("|")))))
+    return rows
+
+def fake_bundle_for_prompt(prompt_text: str) -> Dict[str, Any]:
+    rows = _product_rows(prompt_text)[:FAKE_BUNDLE_SIZE]
+    prices = []
+    for row in rows:
+        try:
+            prices.append(round(float(row.get("Price €", "0")), 2))
+        except ValueError:
+            prices.append(0.0)
+    original_total = round(sum(prices), 2)
+    return {
+        "bundle_name": "Benchmark Bundle", "products": [row.get("Product Name", "") for row in rows],
+        "skus": [row.get("BaseSKU", "") for row in rows], "price_per_product": prices,
+        "product_stock_levels": [row.get("Stock", "Stock data N/A") for row in rows],
+        "product_sales_metrics": [row.get("Sales", "Sales data N/A") for row in rows],
+        "total_price": round(original_total * (1 - FAKE_DISCOUNT_PERCENT / 100), 2), "original_total_price": original_total,
+        "discount_percent": FAKE_DISCOUNT_PERCENT, "trend": "Synthetic", "margin": "Estimated due to lack of cost data",
+        "margin_type": "percentage", "summary": "Top retrieved products.", "result": "Benchmark run.",
+        "recommended_duration_notes": "Duration: 14 days from 2024-01-01",
+    }
+
+class FakeChatModel(BaseChatModel):
+    """Chat model standing in for ChatOpenAI; accepts and ignores ChatOpenAI's constructor arguments."""
+    model_name: str = "gpt-3.5-turbo"
+    temperature: float = 0.0
+    latency_seconds: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "bench-fake-chat"
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        time.sleep(self.latency_seconds)
+        content = json.dumps(fake_bundle_for_prompt(str(messages[-1].content)), ensure_ascii=False)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+def install_fakes(app_module, embedding_latency_seconds: float = 0.0, embedding_per_text_latency_seconds: float = 0.0,
+                  llm_latency_seconds: float = 0.0) -> FakeEmbeddingFunction:
+    """Points app.py's OpenAI constructors at the stand-ins. Call before app_module.init_components()."""
+    embedding_function = FakeEmbeddingFunction(embedding_latency_seconds, embedding_per_text_latency_seconds)
+    app_module.embedding_functions = types.SimpleNamespace(OpenAIEmbeddingFunction=lambda **_: embedding_function)
+    app_module.OpenAIEmbeddings = FakeOpenAIEmbeddings
+    app_module.ChatOpenAI = functools.partial(FakeChatModel, latency_seconds=llm_latency_seconds)
+    return embedding_function
@@ -0,0 +1,379 @@
+"""Offline benchmark runner. No OpenAI calls are made: bench.fakes stands in for embeddings and the chat model.
+
+    python -m bench.run all --sizes 10000,100000,1000000 --output bench/results/before.json
+    python -m bench.run catalog --orders orders.csv --queries 200
+    python -m bench.run load --orders orders.csv --concurrency 1,4,16 --requests 200
+    python -m bench.run compare bench/results/before.json bench/results/after.json
+
+`all` generates (and caches) synthetic order files, then runs each scenario in a fresh subprocess so peak RSS and
+import-time state are per scenario. Results are JSON, tagged with the git commit, for comparing runs.
+"""
+import argparse
+import csv
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Windows: peak RSS is not reported.
+    resource = None
+
+from bench.fakes import fake_embedding, install_fakes
+from bench.synthetic_orders import CATEGORIES, write_orders_file
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_DATA_DIR = os.path.join(REPO_ROOT, "bench", "data")
+DEFAULT_RESULTS_DIR = os.path.join(REPO_ROOT, "bench", "results")
+PROMPT_TEMPLATES = [
+    "Create a bundle of {category} products",
+    "{category} gift set under {price} euros",
+    "Summer promotion bundle for {category} and {other} lovers",
+    "Starter kit with {category} essentials",
+    "Weekend deal on {category} items",
+    "Bundle of our best selling {category} products",
+    "Popular {category} and {other} picks",
+    "Bundle of up to {items} {category} items",
+]
+LOAD_WARMUP_REQUESTS = 5
+CHANGED_PRODUCT_SHARE = 0.02  # Products whose title changes between the full ingestion and each differential refresh.
+CHANGED_REFRESHES = 3  # The first refresh builds a new generation; later ones update the standby generation in place.
+LOAD_FAILURE_SAMPLES = 10
+
+def peak_rss_mb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)  # bytes on macOS, KiB on Linux
+
+def summarize_latencies(seconds: List[float]) -> Dict[str, Any]:
+    if not seconds:
+        return {"count": 0}
+    ms = np.asarray(seconds) * 1000
+    return {"count": len(ms), "mean_ms": round(float(ms.mean()), 2), "p50_ms": round(float(np.percentile(ms, 50)), 2),
+            "p95_ms": round(float(np.percentile(ms, 95)), 2), "p99_ms": round(float(np.percentile(ms, 99)), 2),
+            "max_ms": round(float(ms.max()), 2)}
+
+def make_prompts(count: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    prompts = []
+    for i in range(count):
+        category, other = rng.sample(CATEGORIES, 2)
+        price = rng.choice([50, 100, 200, 500])
+        items = rng.choice([2, 3, 4])
+        # The request number keeps prompts distinct so the exact-match response cache cannot answer them.
+        prompts.append(rng.choice(PROMPT_TEMPLATES).format(category=category, other=other, price=price, items=items) + f" #{i}")
+    return prompts
+
+def git_revision() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPO_ROOT, capture_output=True, text=True, check=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--", "app.py"], cwd=REPO_ROOT, capture_output=True,
+                                    text=True, check=True).stdout.strip())
+        return {"commit": commit, "app_py_modified": dirty}
+    except (OSError, subprocess.CalledProcessError):
+        return {"commit": None, "app_py_modified": None}
+
+def load_app(args):
+    """Imports app.py inside a fresh working directory with the OpenAI stand-ins installed and components initialized."""
+    workdir = tempfile.mkdtemp(prefix="bundle-bench-")
+    os.chdir(workdir)
+    os.environ["OPENAI_API_KEY"] = "sk-bench-offline"  # Never let a benchmark reach the real API.
+    if not args.response_cache:
+        os.environ["LLM_RESPONSE_CACHE_MAX_ENTRIES"] = "0"
+    sys.path.insert(0, REPO_ROOT)
+    import app as app_module
+    if not args.verbose:
+        app_module.app.logger.setLevel(logging.WARNING)
+        logging.getLogger("chromadb").setLevel(logging.WARNING)
+    embedding_function = install_fakes(app_module, args.embedding_latency, args.embedding_per_text_latency, args.llm_latency)
+    if not app_module.init_components():
+        raise SystemExit(f"Component initialization failed: {app_module.component_status}")
+    return app_module, embedding_function, workdir
+
+def ingest_stage_seconds(app_module) -> Dict[str, float]:
+    """Cumulative seconds per ingestion stage, from app.py's in-process metrics."""
+    histograms = app_module.metrics._histograms
+    return {dict(labels)["stage"]: histogram["sum"] for (name, labels), histogram in histograms.items()
+            if name == "ingest_stage_duration_seconds"}
+
+def write_changed_orders_file(app_module, orders_path: str, share: float, edition: int) -> tuple:
+    """CSV copy of the export in which the titles of about `share` of the BaseSKUs change, like a routine catalog
+    update; each `edition` changes a different sample. Returns (path, number of changed BaseSKUs)."""
+    path = os.path.abspath("orders-changed.csv")
+    changed_skus = set()
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        for source_idx, (file_path, sheet_name) in enumerate(app_module.list_order_sources([orders_path])):
+            rows = app_module.iter_order_rows(file_path, sheet_name)
+            header = [str(value).strip() if value is not None else "" for value in next(rows)]
+            if source_idx == 0:
+                writer.writerow(header)
+            sku_col, title_col = header.index(app_module.ORDERS_SKU_COLUMN), header.index(app_module.ORDERS_ITEM_TITLE_COLUMN)
+            for row in rows:
+                row = list(row)
+                base_sku = str(row[sku_col] or "").partition("|")[0].strip() if len(row) > max(sku_col, title_col) else ""
+                if base_sku and zlib.crc32(f"{edition}:{base_sku}".encode("utf-8")) % 10000 < share * 10000:
+                    row[title_col] = f"{row[title_col] or base_sku} (edition {edition})"
+                    changed_skus.add(base_sku)
+                writer.writerow(row)
+    return path, len(changed_skus)
+
+def ingest(app_module, orders_path: str, embedding_function=None, changed_share: float = 0.0) -> Dict[str, Any]:
+    rss_before = peak_rss_mb()
+    progress: Dict[str, Any] = {}
+    started_at = time.perf_counter()
+    succeeded = app_module.ensure_data_is_ingested(orders_path, force_reingest=True, progress=progress)
+    seconds = time.perf_counter() - started_at
+    if not succeeded:
+        raise SystemExit(f"Ingestion of '{orders_path}' failed.")
+    rows = progress.get("rows_processed") or 0
+    embedding_calls = embedding_function.calls if embedding_function is not None else None
+
+    started_at = time.perf_counter()
+    app_module.ensure_data_is_ingested(orders_path, force_reingest=True)
+    unchanged_seconds = time.perf_counter() - started_at
+
+    # Without the ingest state the file is no longer recognised as ingested, as after a metadata version bump:
+    # the catalog is rebuilt from the export (or its aggregated snapshot) and diffed against the collection.
+    os.remove(app_module.INGEST_STATE_FILE)
+    started_at = time.perf_counter()
+    app_module.ensure_data_is_ingested(orders_path, force_reingest=True)
+    rebuild_seconds = time.perf_counter() - started_at
+    result = {"rows": rows, "products": app_module.product_collection.count(), "seconds": round(seconds, 3),
+              "rows_per_second": round(rows / seconds, 1) if seconds else None, "embedding_calls": embedding_calls,
+              "unchanged_reingest_seconds": round(unchanged_seconds, 3),
+              "unchanged_rebuild_seconds": round(rebuild_seconds, 3)}
+
+    # Differential refreshes after small catalog changes, compared with the full ingestion above.
+    result["changed_refreshes"] = []
+    for edition in range(1, CHANGED_REFRESHES + 1 if changed_share else 1):
+        changed_path, changed_products = write_changed_orders_file(app_module, orders_path, changed_share, edition)
+        calls_before, stages_before = embedding_function.calls if embedding_function is not None else 0, ingest_stage_seconds(app_module)
+        started_at = time.perf_counter()
+        if not app_module.ensure_data_is_ingested(changed_path, force_reingest=True):
+            raise SystemExit(f"Differential refresh from '{changed_path}' failed.")
+        refresh_seconds = time.perf_counter() - started_at
+        stages_after = ingest_stage_seconds(app_module)
+        result["changed_refreshes"].append({
+            "edition": edition, "changed_products": changed_products, "seconds": round(refresh_seconds, 3),
+            "share_of_full_seconds": round(refresh_seconds / seconds, 3) if seconds else None,
+            "embedding_calls": embedding_function.calls - calls_before if embedding_function is not None else None,
+            "stage_seconds": {stage: round(total - stages_before.get(stage, 0.0), 3) for stage, total in stages_after.items()
+                              if stage != "total" and total - stages_before.get(stage, 0.0) > 0},
+        })
+        os.remove(changed_path)
+    result.update(peak_rss_mb_before=rss_before, peak_rss_mb=peak_rss_mb())
+    return result
+
+def run_catalog(args) -> Dict[str, Any]:
+    """Ingestion throughput and peak RSS for one order file, then query latency against the resulting collection."""
+    app_module, embedding_function, workdir = load_app(args)
+    result = {"orders": os.path.basename(args.orders),
+              "ingest": ingest(app_module, args.orders, embedding_function, changed_share=CHANGED_PRODUCT_SHARE)}
+
+    collection = app_module.product_collection
+    prompts = make_prompts(args.queries, seed=args.seed)
+    n_results = min(app_module.LLM_CONTEXT_PRODUCT_LIMIT, collection.count())
+    query_seconds = []
+    for prompt in prompts:
+        embedding = fake_embedding(prompt)
+        started_at = time.perf_counter()
+        collection.query(query_embeddings=[embedding], n_results=n_results, include=["metadatas"])
+        query_seconds.append(time.perf_counter() - started_at)
+    retrieval_seconds = []
+    for prompt in prompts:
+        started_at = time.perf_counter()
+        app_module.retrieve_bundle_context(collection, prompt)
+        retrieval_seconds.append(time.perf_counter() - started_at)
+    result["collection_size"] = collection.count()
+    result["chroma_query"] = summarize_latencies(query_seconds)
+    result["retrieval"] = summarize_latencies(retrieval_seconds)
+    result["workdir"] = workdir
+    return result
+
+def _post_generate(url: str, prompt: str):
+    request = urllib.request.Request(url, data=json.dumps({"user_input": prompt}).encode("utf-8"),
+                                     headers={"Content-Type": "application/json"})
+    started_at = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=300) as response:
+            response.read()
+            status, cache = response.status, response.headers.get("X-Bundle-Cache")
+    except urllib.error.HTTPError as e:
+        status, cache = e.code, None
+    except (urllib.error.URLError, OSError):
+        status, cache = 0, None
+    return time.perf_counter() - started_at, status, cache
+
+def run_load(args) -> Dict[str, Any]:
+    """End-to-end /generate latency through a local threaded HTTP server at each concurrency level."""
+    from werkzeug.serving import make_server
+
+    app_module, _, workdir = load_app(args)
+    ingest_result = ingest(app_module, args.orders)
+    server = make_server("127.0.0.1", 0, app_module.create_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/generate"
+    try:
+        for prompt in make_prompts(LOAD_WARMUP_REQUESTS, seed=args.seed + 1000):
+            _post_generate(url, prompt)
+        levels = []
+        for level_idx, concurrency in enumerate(int(c) for c in args.concurrency.split(",")):
+            prompts = make_prompts(args.requests, seed=args.seed + level_idx)
+            started_at = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                outcomes = list(pool.map(lambda prompt: _post_generate(url, prompt), prompts))
+            wall_seconds = time.perf_counter() - started_at
+            ok_seconds = [seconds for seconds, status, _ in outcomes if status == 200]
+            status_counts: Dict[str, int] = {}
+            for _, status, _ in outcomes:
+                status_counts[str(status)] = status_counts.get(str(status), 0) + 1
+            # Status 0 means the request never got a response (connection error or timeout).
+            failures = [{"prompt": prompt, "status": status} for prompt, (_, status, _) in zip(prompts, outcomes) if status != 200]
+            if failures:
+                print(f"{len(failures)} of {len(prompts)} /generate requests failed at concurrency {concurrency}: {status_counts}", file=sys.stderr)
+            levels.append({
+                "concurrency": concurrency, "requests": len(prompts), "errors": len(failures),
+                "error_rate": round(len(failures) / len(prompts), 4), "status_counts": status_counts,
+                "failures": failures[:LOAD_FAILURE_SAMPLES],
+                "cache_hits": sum(1 for _, status, cache in outcomes if status == 200 and cache and cache != "miss"),
+                "wall_seconds": round(wall_seconds, 3), "throughput_rps": round(len(prompts) / wall_seconds, 2),
+                **summarize_latencies(ok_seconds),
+            })
+    finally:
+        server.shutdown()
+    return {"orders": os.path.basename(args.orders), "collection_size": ingest_result["products"],
+            "llm_latency_seconds": args.llm_latency, "embedding_latency_seconds": args.embedding_latency,
+            "failed_requests": sum(level["errors"] for level in levels), "passed": all(level["errors"] == 0 for level in levels),
+            "levels": levels, "peak_rss_mb": peak_rss_mb(), "workdir": workdir}
+
+def orders_file_for(rows: int, args) -> str:
+    path = os.path.join(args.data_dir, f"orders-{rows}-seed{args.seed}.{args.format}")
+    if not os.path.exists(path):
+        print(f"Generating {rows} synthetic order rows -> {path}", file=sys.stderr)
+        write_orders_file(path, rows, seed=args.seed)
+    return path
+
+def run_scenario_subprocess(scenario: str, orders_path: str, args) -> Dict[str, Any]:
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+        output_path = f.name
+    command = [sys.executable, "-m", "bench.run", scenario, "--orders", orders_path, "--output", output_path,
+               "--seed", str(args.seed), "--embedding-latency", str(args.embedding_latency),
+               "--embedding-per-text-latency", str(args.embedding_per_text_latency), "--llm-latency", str(args.llm_latency),
+               "--queries", str(args.queries), "--concurrency", args.concurrency, "--requests", str(args.requests)]
+    if args.response_cache:
+        command.append("--response-cache")
+    if args.verbose:
+        command.append("--verbose")
+    print(f"Running {scenario} on {os.path.basename(orders_path)}", file=sys.stderr)
+    try:
+        subprocess.run(command, cwd=REPO_ROOT, check=True)
+        with open(output_path, encoding="utf-8") as f:
+            return json.load(f)
+    finally:
+        os.remove(output_path)
+
+def run_all(args) -> Dict[str, Any]:
+    sizes = [int(size) for size in args.sizes.split(",")]
+    catalogs = [run_scenario_subprocess("catalog", orders_file_for(rows, args), args) for rows in sizes]
+    load = run_scenario_subprocess("load", orders_file_for(args.load_rows, args), args) if args.requests > 0 else None
+    return {"catalog": catalogs, "load": load}
+
+def flatten_metrics(value: Any, prefix: str = "") -> Dict[str, float]:
+    """Numeric leaves keyed by dotted path; list items are keyed by their rows/concurrency/orders field."""
+    flat: Dict[str, float] = {}
+    if isinstance(value, dict):
+        for key, child in value.items():
+            if key not in ("meta", "workdir"):
+                flat.update(flatten_metrics(child, f"{prefix}{key}."))
+    elif isinstance(value, list):
+        for i, child in enumerate(value):
+            label = i
+            if isinstance(child, dict):
+                label = next((f"{key}={child[key]}" for key in ("concurrency", "orders") if key in child), i)
+            flat.update(flatten_metrics(child, f"{prefix}[{label}]."))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        flat[prefix.rstrip(".")] = float(value)
+    return flat
+
+def compare(old_path: str, new_path: str):
+    with open(old_path, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, encoding="utf-8") as f:
+        new = json.load(f)
+    old_flat, new_flat = flatten_metrics(old), flatten_metrics(new)
+    print(f"old: {old.get('meta', {}).get('git', {}).get('commit')}  new: {new.get('meta', {}).get('git', {}).get('commit')}")
+    for key in sorted(set(old_flat) & set(new_flat)):
+        before, after = old_flat[key], new_flat[key]
+        change = f"{(after - before) / before * 100:+.1f}%" if before else "n/a"
+        print(f"{key:80s} {before:14.2f} {after:14.2f} {change:>9s}")
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Offline benchmarks for app.py.")
+    parser.add_argument("scenario", choices=["all", "catalog", "load", "compare"])
+    parser.add_argument("paths", nargs="*", help="compare: OLD.json NEW.json")
+    parser.add_argument("--orders", help="Order export to ingest (catalog/load)")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="all: synthetic row counts for the catalog benchmark")
+    parser.add_argument("--load-rows", type=int, default=10000, help="all: synthetic row count for the /generate load test")
+    parser.add_argument("--format", default="csv", choices=["csv", "csv.gz", "xlsx"], help="all: synthetic file format")
+    parser.add_argument("--data-dir", default=DEFAULT_DATA_DIR, help="all: where generated order files are cached")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", type=int, default=200, help="Queries per collection for query latency")
+    parser.add_argument("--concurrency", default="1,4,16", help="Concurrent /generate clients per load level")
+    parser.add_argument("--requests", type=int, default=200, help="/generate requests per load level (0 skips the load test)")
+    parser.add_argument("--embedding-latency", type=float, default=0.05, help="Seconds per fake embedding call")
+    parser.add_argument("--embedding-per-text-latency", type=float, default=0.0, help="Extra seconds per embedded text")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Seconds per fake chat completion")
+    parser.add_argument("--response-cache", action="store_true", help="Keep the bundle response cache enabled")
+    parser.add_argument("--verbose", action="store_true", help="Keep app.py's INFO logging")
+    parser.add_argument("--keep-workdir", action="store_true", help="Keep the Chroma data built by catalog/load runs")
+    parser.add_argument("--output", help="Result JSON path (default: bench/results/<timestamp>-<commit>.json)")
+    args = parser.parse_args(argv)
+
+    if args.scenario == "compare":
+        if len(args.paths) != 2:
+            parser.error("compare takes two result files")
+        compare(*args.paths)
+        return
+    if args.scenario in ("catalog", "load") and not args.orders:
+        parser.error(f"{args.scenario} requires --orders")
+    # Scenarios chdir into a scratch directory before importing app.py.
+    args.orders = os.path.abspath(args.orders) if args.orders else None
+    args.output = os.path.abspath(args.output) if args.output else None
+
+    started_at = time.time()
+    results = {"all": run_all, "catalog": run_catalog, "load": run_load}[args.scenario](args)
+    results["meta"] = {
+        "scenario": args.scenario, "git": git_revision(), "started_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(started_at)),
+        "seconds": round(time.time() - started_at, 1), "python": platform.python_version(), "platform": platform.platform(),
+        "cpu_count": os.cpu_count(), "args": {key: value for key, value in vars(args).items() if key not in ("paths", "output")},
+    }
+    output_path = args.output
+    if output_path is None:
+        os.makedirs(DEFAULT_RESULTS_DIR, exist_ok=True)
+        commit = (results["meta"]["git"]["commit"] or "nogit")[:10]
+        output_path = os.path.join(DEFAULT_RESULTS_DIR, f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(started_at))}-{commit}.json")
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output_path}", file=sys.stderr)
+    if results.get("workdir") and not args.keep_workdir:
+        shutil.rmtree(results["workdir"], ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
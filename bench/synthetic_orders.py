@@ -0,0 +1,153 @@
+"""Synthetic `orders` exports with the same headers as the shop export app.py ingests.
+
+SKU popularity follows a Zipf-like power law, baskets have a geometric size, and part of each basket is drawn from
+a fixed set of same-category "affinity" partners so the co-purchase index has real structure to find.
+
+    python -m bench.synthetic_orders bench_orders_100k.csv.gz --rows 100000
+"""
+import argparse
+import csv
+import gzip
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import openpyxl
+
+ORDERS_SHEET = "orders"
+HEADERS = [
+    "OrderNumber", "CreatedDate", "SKU", "Item title", "Category", "Brand", "Quantity",
+    "OriginalUnitPrice", "FinalUnitPrice", "OriginalLineTotal", "FinalLineTotal",
+    "FinalOrderItemsTotal", "ShippingTotal", "TotalOrderAmount", "UserID",
+]
+CATEGORIES = ["Hydration", "Apparel", "Electronics", "Skincare", "Home", "Kitchen", "Outdoor", "Fitness",
+              "Toys", "Stationery", "Pet Supplies", "Gadgets"]
+CATEGORY_WEIGHTS = [8, 14, 9, 12, 10, 9, 7, 8, 6, 5, 6, 6]
+ADJECTIVES = ["Eco", "Classic", "Premium", "Compact", "Organic", "Wireless", "Smart", "Soft", "Travel", "Pro"]
+NOUNS = {
+    "Hydration": ["Bottle", "Flask", "Tumbler"], "Apparel": ["T-Shirt", "Hoodie", "Cap", "Socks"],
+    "Electronics": ["Headphones", "Speaker", "Charger"], "Skincare": ["Serum", "Cream", "Cleanser", "Sunscreen"],
+    "Home": ["Candle", "Blanket", "Vase"], "Kitchen": ["Knife Set", "Pan", "Mug"], "Outdoor": ["Tent", "Backpack", "Lantern"],
+    "Fitness": ["Yoga Mat", "Dumbbell", "Resistance Band"], "Toys": ["Puzzle", "Plush", "Building Set"],
+    "Stationery": ["Notebook", "Pen Set", "Planner"], "Pet Supplies": ["Leash", "Pet Bed", "Bowl"],
+    "Gadgets": ["Tracker", "Lamp", "Power Bank"],
+}
+BRANDS = ["Eco", "AppCo", "SoundMax", "Lumi", "NordHome", "Peak", "Generic"]
+COLORS = ["RED", "BLU", "BLK", "WHT", "GRN"]
+SIZES = ["S", "M", "L", "OS"]
+PARTNERS_PER_SKU = 3
+AFFINITY_SHARE = 0.35  # Share of non-first basket lines drawn from the first line's partners.
+SHIPPING_FEE = 5.0
+
+def default_sku_count(rows: int) -> int:
+    return max(50, rows // 25)
+
+def _build_catalog(rng: np.random.Generator, num_skus: int) -> Dict[str, Any]:
+    categories = rng.choice(len(CATEGORIES), size=num_skus, p=np.asarray(CATEGORY_WEIGHTS) / sum(CATEGORY_WEIGHTS))
+    prices = np.round(np.exp(rng.normal(3.2, 0.8, size=num_skus)), 0) - 0.01
+    prices = np.clip(prices, 1.99, 999.99)
+    names, brands = [], []
+    for i in range(num_skus):
+        category = CATEGORIES[categories[i]]
+        nouns = NOUNS[category]
+        names.append(f"{ADJECTIVES[rng.integers(len(ADJECTIVES))]} {nouns[rng.integers(len(nouns))]} {i:05d}")
+        brands.append(BRANDS[rng.integers(len(BRANDS))])
+    # Affinity partners: other SKUs of the same category, fixed per SKU.
+    skus_by_category = {c: np.flatnonzero(categories == c) for c in range(len(CATEGORIES))}
+    partners = np.empty((num_skus, PARTNERS_PER_SKU), dtype=np.int64)
+    for c, members in skus_by_category.items():
+        if len(members):
+            partners[members] = rng.choice(members, size=(len(members), PARTNERS_PER_SKU))
+    return {"categories": categories, "prices": prices, "names": names, "brands": brands, "partners": partners}
+
+def generate_order_lines(rows: int, num_skus: Optional[int] = None, seed: int = 0, zipf_exponent: float = 1.1) -> Dict[str, Any]:
+    """Column arrays for `rows` order lines. Deterministic for a given (rows, num_skus, seed, zipf_exponent)."""
+    rng = np.random.default_rng(seed)
+    num_skus = num_skus or default_sku_count(rows)
+    catalog = _build_catalog(rng, num_skus)
+
+    # Popularity rank is shuffled so SKU numbering does not encode it.
+    popularity = 1.0 / np.arange(1, num_skus + 1) ** zipf_exponent
+    popularity = rng.permutation(popularity / popularity.sum())
+
+    basket_sizes = np.minimum(rng.geometric(0.45, size=rows), 20)
+    basket_sizes = basket_sizes[:np.searchsorted(np.cumsum(basket_sizes), rows) + 1]
+    basket_sizes[-1] -= basket_sizes.sum() - rows
+    basket_sizes = basket_sizes[basket_sizes > 0]
+    order_of_line = np.repeat(np.arange(len(basket_sizes)), basket_sizes)
+    first_line_of_order = np.concatenate(([0], np.cumsum(basket_sizes)[:-1]))
+
+    sku_of_line = rng.choice(num_skus, size=rows, p=popularity)
+    anchor_sku = sku_of_line[first_line_of_order][order_of_line]
+    is_affinity_line = (rng.random(rows) < AFFINITY_SHARE) & (np.arange(rows) != first_line_of_order[order_of_line])
+    partner_choice = rng.integers(PARTNERS_PER_SKU, size=rows)
+    sku_of_line = np.where(is_affinity_line, catalog["partners"][anchor_sku, partner_choice], sku_of_line)
+
+    original_prices = catalog["prices"][sku_of_line]
+    discounts = rng.choice([0.0, 0.1, 0.2], size=rows, p=[0.8, 0.15, 0.05])
+    final_prices = np.round(original_prices * (1 - discounts), 2)
+    quantities = np.minimum(rng.geometric(0.7, size=rows), 10)
+    order_item_totals = np.bincount(order_of_line, weights=final_prices * quantities)
+    return {
+        "num_skus": num_skus, "num_orders": len(basket_sizes), "catalog": catalog,
+        "order_of_line": order_of_line, "sku_of_line": sku_of_line,
+        "color_of_line": rng.integers(len(COLORS), size=rows), "size_of_line": rng.integers(len(SIZES), size=rows),
+        "original_prices": original_prices, "final_prices": final_prices, "quantities": quantities,
+        "order_item_totals": order_item_totals, "user_of_order": rng.integers(max(1, rows // 4), size=len(basket_sizes)),
+        "missing_title": rng.random(rows) < 0.001, "text_quantity": rng.random(rows) < 0.05,
+    }
+
+def iter_order_rows(lines: Dict[str, Any]):
+    catalog = lines["catalog"]
+    num_orders = lines["num_orders"]
+    start = np.datetime64("2023-01-01")
+    for i in range(len(lines["sku_of_line"])):
+        order = lines["order_of_line"][i]
+        sku = lines["sku_of_line"][i]
+        color, size = COLORS[lines["color_of_line"][i]], SIZES[lines["size_of_line"][i]]
+        quantity = int(lines["quantities"][i])
+        original_price, final_price = float(lines["original_prices"][i]), float(lines["final_prices"][i])
+        items_total = round(float(lines["order_item_totals"][order]), 2)
+        yield [
+            f"ORD{order:08d}", str(start + int(order * 730 // num_orders)), f"SKU{sku:05d}|{color}|{size}",
+            None if lines["missing_title"][i] else f"{catalog['names'][sku]} ({color}, {size})",
+            CATEGORIES[catalog["categories"][sku]], catalog["brands"][sku],
+            f"{quantity}.00" if lines["text_quantity"][i] else quantity,
+            original_price, final_price, round(original_price * quantity, 2), round(final_price * quantity, 2),
+            items_total, SHIPPING_FEE, round(items_total + SHIPPING_FEE, 2), f"U{lines['user_of_order'][order]}",
+        ]
+
+def write_orders_file(path: str, rows: int, num_skus: Optional[int] = None, seed: int = 0, zipf_exponent: float = 1.1) -> Dict[str, Any]:
+    """Writes a synthetic export as .xlsx (an `orders` sheet), .csv or .csv.gz. Returns a summary of what was written."""
+    started_at = time.perf_counter()
+    lines = generate_order_lines(rows, num_skus, seed, zipf_exponent)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if path.lower().endswith((".xlsx", ".xlsm")):
+        wb = openpyxl.Workbook(write_only=True)
+        ws = wb.create_sheet(ORDERS_SHEET)
+        ws.append(HEADERS)
+        for row in iter_order_rows(lines):
+            ws.append(row)
+        wb.save(path)
+    else:
+        opener = gzip.open if path.lower().endswith(".gz") else open
+        with opener(path, "wt", newline="", encoding="utf-8") as f:
+            writer = csv.writer(f)
+            writer.writerow(HEADERS)
+            writer.writerows(iter_order_rows(lines))
+    return {"path": path, "rows": rows, "skus": lines["num_skus"], "orders": lines["num_orders"], "seed": seed,
+            "zipf_exponent": zipf_exponent, "bytes": os.path.getsize(path), "seconds": round(time.perf_counter() - started_at, 3)}
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Write a synthetic order export for benchmarks.")
+    parser.add_argument("path", help="Output file: .xlsx, .csv or .csv.gz")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--skus", type=int, default=None, help="Distinct BaseSKUs (default: rows / 25, at least 50)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--zipf", type=float, default=1.1, help="SKU popularity exponent")
+    args = parser.parse_args(argv)
+    print(write_orders_file(args.path, args.rows, args.skus, args.seed, args.zipf))
+
+if __name__ == "__main__":
+    main()
@@ -306,12 +306,17 @@ document.getElementById("uploadForm").addEventListener("submit", async (e) => {
   submitButton.textContent = "Generating...";
 
   try {
-    const response = await fetch("/generate", {
+    const response = await fetch("/generate/stream", {
       method: "POST",
       body: formData,
     });
 
-    const bundle = await response.json();
+    const ingestionJobId = response.headers.get("X-Ingestion-Job-Id");
+    if (ingestionJobId) {
+      pollIngestionJob(ingestionJobId);
+    }
+
+    const bundle = await readBundleStream(response);
     renderBundle(bundle);
 
     if (!bundle.error) {
@@ -344,6 +349,107 @@ document.getElementById("uploadForm").addEventListener("submit", async (e) => {
   }
 });
 
+function parseSseEvent(rawEvent) {
+  let event = "message";
+  const dataLines = [];
+  rawEvent.split("\n").forEach((line) => {
+    if (line.startsWith("event:")) {
+      event = line.slice(6).trim();
+    } else if (line.startsWith("data:")) {
+      dataLines.push(line.slice(5).trim());
+    }
+  });
+  return { event, data: dataLines.length ? JSON.parse(dataLines.join("\n")) : null };
+}
+
+// Reads the /generate/stream SSE response, rendering partial bundles as they arrive,
+// and resolves with the final bundle (or an { error } object).
+async function readBundleStream(response) {
+  if (!response.ok || !response.body) {
+    return await response.json();
+  }
+
+  const bundleDiv = document.querySelector(".bundle");
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let lastRenderAt = 0;
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let separatorIndex;
+    while ((separatorIndex = buffer.indexOf("\n\n")) !== -1) {
+      const rawEvent = buffer.slice(0, separatorIndex);
+      buffer = buffer.slice(separatorIndex + 2);
+      const { event, data } = parseSseEvent(rawEvent);
+
+      if (event === "retrieval") {
+        bundleDiv.innerHTML = `<p><em>Found ${data.products.length} relevant products. Building your bundle...</em></p>`;
+      } else if (event === "partial") {
+        // Chart animations make re-rendering on every token expensive, so throttle partial renders.
+        const now = Date.now();
+        if (now - lastRenderAt > 200) {
+          renderBundle(data);
+          lastRenderAt = now;
+        }
+      } else if (event === "final") {
+        return data.bundle;
+      } else if (event === "error") {
+        return { error: data.error };
+      }
+    }
+  }
+  return { error: "The bundle stream ended before a final result was received." };
+}
+
+async function pollIngestionJob(jobId) {
+  const form = document.getElementById("uploadForm");
+  let statusEl = document.querySelector(".ingest-status");
+  if (!statusEl) {
+    statusEl = document.createElement("p");
+    statusEl.className = "ingest-status";
+    form.insertAdjacentElement("afterend", statusEl);
+  }
+
+  while (true) {
+    let job;
+    try {
+      const response = await fetch(`/ingest/${jobId}`);
+      job = await response.json();
+    } catch (error) {
+      console.error("Failed to fetch ingestion status:", error);
+      statusEl.textContent = "Could not fetch data upload status.";
+      return;
+    }
+
+    if (job.error && !job.status) {
+      statusEl.textContent = `Data upload: ${job.error}`;
+      return;
+    }
+    if (job.status === "completed") {
+      statusEl.textContent = "Data upload processed. New bundles will use the updated catalog.";
+      return;
+    }
+    if (job.status === "failed") {
+      statusEl.textContent = `Data upload failed: ${job.error || "unknown error"}`;
+      return;
+    }
+
+    let detail = `${job.rows_processed || 0} rows read`;
+    if (job.batches_total) {
+      detail += `, ${job.batches_embedded}/${job.batches_total} batches embedded`;
+    }
+    if (job.eta_seconds !== null && job.eta_seconds !== undefined) {
+      detail += `, ~${Math.ceil(job.eta_seconds)}s left`;
+    }
+    statusEl.textContent = `Processing data upload (${job.stage}): ${detail}...`;
+    await new Promise((resolve) => setTimeout(resolve, 1000));
+  }
+}
+
 function renderBundle(bundle) {
   const bundleDiv = document.querySelector(".bundle");
   const chartCanvas = document.getElementById("bundle-chart");